@@ -0,0 +1,174 @@
+'''
+Tiny GPT ONNX Export & Int8 Quantization
+Description: Exports an HF GPT checkpoint directory (e.g. LLM-from-Scratch/checkpoint-99)
+to ONNX with KV-cache inputs/outputs, produces a dynamically int8-quantized
+variant, checks both against the PyTorch model (logits and greedy KV-cache
+decoding) and compares CPU latency.
+
+Usage:  python Export-Tiny-GPT-ONNX.py LLM-from-Scratch/checkpoint-99 --out tiny-gpt-onnx
+'''
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import time
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import onnxruntime
+import torch
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from optimum.exporters.onnx import main_export
+from transformers import AutoConfig, AutoModelForCausalLM
+
+# -----------------------------------------------------------------------------
+# Logging configuration
+# -----------------------------------------------------------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Export
+# -----------------------------------------------------------------------------
+def export(checkpoint: str, out_dir: str) -> Tuple[str, str]:
+    """Write ``model.onnx`` (with past key/values) and ``model_int8.onnx``."""
+    main_export(checkpoint, output=out_dir, task="text-generation-with-past", device="cpu")
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    int8_path = os.path.join(out_dir, "model_int8.onnx")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    logger.info("Exported %s -> %s (%.1f KB) and %s (%.1f KB)", checkpoint,
+                fp32_path, os.path.getsize(fp32_path) / 1024, int8_path, os.path.getsize(int8_path) / 1024)
+    return fp32_path, int8_path
+
+# -----------------------------------------------------------------------------
+# ONNX Runtime decoding with KV cache
+# -----------------------------------------------------------------------------
+class OnnxDecoder:
+    """Greedy decoding over an exported decoder, feeding ``present.*`` back as ``past_key_values.*``.
+
+    The feed is built from the session's own input names, so the same code
+    runs the fp32 and the quantized graph.
+    """
+
+    def __init__(self, path: str, config: Any, threads: int = 1) -> None:
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.sess = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.sess.get_inputs()]
+        self.output_names = [o.name for o in self.sess.get_outputs()]
+        self.n_layer = config.n_layer
+        self.n_head = config.n_head
+        self.head_dim = config.n_embd // config.n_head
+
+    def _empty_past(self, batch: int) -> Dict[str, np.ndarray]:
+        empty = np.zeros((batch, self.n_head, 0, self.head_dim), dtype=np.float32)
+        return {name: empty for name in self.input_names if name.startswith("past_key_values")}
+
+    def forward(self, input_ids: np.ndarray, past: Dict[str, np.ndarray], past_len: int):
+        batch, length = input_ids.shape
+        feed = {"input_ids": input_ids.astype(np.int64), **past}
+        if "attention_mask" in self.input_names:
+            feed["attention_mask"] = np.ones((batch, past_len + length), dtype=np.int64)
+        if "position_ids" in self.input_names:
+            feed["position_ids"] = np.broadcast_to(np.arange(past_len, past_len + length, dtype=np.int64),
+                                                   (batch, length)).copy()
+        outputs = dict(zip(self.output_names, self.sess.run(self.output_names, feed)))
+        new_past = {name.replace("present", "past_key_values"): value
+                    for name, value in outputs.items() if name.startswith("present")}
+        return outputs["logits"], new_past
+
+    def logits(self, input_ids: np.ndarray) -> np.ndarray:
+        return self.forward(input_ids, self._empty_past(input_ids.shape[0]), 0)[0]
+
+    def greedy(self, input_ids: np.ndarray, max_new_tokens: int) -> np.ndarray:
+        logits, past = self.forward(input_ids, self._empty_past(input_ids.shape[0]), 0)
+        tokens, past_len = [], input_ids.shape[1]
+        for step in range(max_new_tokens):
+            next_ids = logits[:, -1].argmax(-1)[:, None]
+            tokens.append(next_ids)
+            if step + 1 < max_new_tokens:
+                logits, past = self.forward(next_ids, past, past_len)
+                past_len += 1
+        return np.concatenate([input_ids] + tokens, axis=1)
+
+# -----------------------------------------------------------------------------
+# Parity & latency
+# -----------------------------------------------------------------------------
+def _median_ms(fn, repeats: int) -> float:
+    fn()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1e3
+
+
+def evaluate(checkpoint: str, paths: Dict[str, str], batch: int, prompt_len: int,
+             repeats: int, threads: int) -> Dict[str, Any]:
+    torch.set_num_threads(threads)
+    config = AutoConfig.from_pretrained(checkpoint)
+    model = AutoModelForCausalLM.from_pretrained(checkpoint).eval()
+    new_tokens = config.n_positions - prompt_len
+    rng = np.random.default_rng(0)
+    prompt = rng.integers(0, config.vocab_size, (batch, prompt_len), dtype=np.int64)
+    prompt_t = torch.from_numpy(prompt)
+
+    with torch.no_grad():
+        ref_logits = model(prompt_t).logits.numpy()
+        ref_tokens = model.generate(prompt_t, attention_mask=torch.ones_like(prompt_t),
+                                    max_new_tokens=new_tokens, min_new_tokens=new_tokens,
+                                    do_sample=False, use_cache=True,
+                                    pad_token_id=config.pad_token_id).numpy()
+
+    def torch_generate():
+        with torch.no_grad():
+            model.generate(prompt_t, attention_mask=torch.ones_like(prompt_t),
+                           max_new_tokens=new_tokens, min_new_tokens=new_tokens,
+                           do_sample=False, use_cache=True, pad_token_id=config.pad_token_id)
+
+    report: Dict[str, Any] = {
+        "checkpoint": checkpoint, "batch": batch, "prompt_len": prompt_len, "new_tokens": new_tokens,
+        "pytorch": {"generate_ms": _median_ms(torch_generate, repeats)},
+    }
+    for name, path in paths.items():
+        decoder = OnnxDecoder(path, config, threads)
+        logits = decoder.logits(prompt)
+        tokens = decoder.greedy(prompt, new_tokens)
+        report[name] = {
+            "size_kb": os.path.getsize(path) / 1024,
+            "max_abs_logit_diff": float(np.abs(logits - ref_logits).max()),
+            "top1_agreement": float((logits.argmax(-1) == ref_logits.argmax(-1)).mean()),
+            "greedy_token_match": float((tokens[:, prompt_len:] == ref_tokens[:, prompt_len:]).mean()),
+            "generate_ms": _median_ms(lambda: decoder.greedy(prompt, new_tokens), repeats),
+        }
+        report[name]["speedup_vs_pytorch"] = report["pytorch"]["generate_ms"] / report[name]["generate_ms"]
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export a tiny GPT checkpoint to ONNX (+int8) and check parity.")
+    parser.add_argument("checkpoint", nargs="?", default="LLM-from-Scratch/checkpoint-99")
+    parser.add_argument("--out", default=None, help="output directory (default: <checkpoint>-onnx)")
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--prompt-len", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--atol", type=float, default=1e-4, help="fp32 logit tolerance")
+    args = parser.parse_args()
+
+    out_dir = args.out or args.checkpoint.rstrip("/") + "-onnx"
+    fp32_path, int8_path = export(args.checkpoint, out_dir)
+    report = evaluate(args.checkpoint, {"onnx_fp32": fp32_path, "onnx_int8": int8_path},
+                      args.batch, args.prompt_len, args.repeats, args.threads)
+    with open(os.path.join(out_dir, "parity_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+    if report["onnx_fp32"]["max_abs_logit_diff"] > args.atol:
+        raise SystemExit(f"fp32 ONNX logits differ from PyTorch by "
+                         f"{report['onnx_fp32']['max_abs_logit_diff']:.2e} > {args.atol}")
@@ -1,31 +1,89 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList
+from transformers import StoppingCriteria, StoppingCriteriaList
 import torch
+from functools import lru_cache
+from typing import Iterator, List, Optional, Sequence, Tuple
 
-# 1. Load a free, open‑access instruction‑tuned model
+from model_registry import get_model
+from speculative_decoding import SpeculativeStats, check_tokenizers_match, speculative_generate
+
+# 1. A free, open‑access instruction‑tuned model, loaded on first use
 model_name = "tiiuae/falcon-7b-instruct"
-tokenizer  = AutoTokenizer.from_pretrained(model_name)
-model      = AutoModelForCausalLM.from_pretrained(
-    model_name,
-    torch_dtype=torch.float16,
-    device_map="auto",
-)
+
+def load_falcon(warmup: bool = False):
+    """Return the cached Falcon model/tokenizer (see model_registry)."""
+    loaded = get_model(model_name, dtype=torch.float16, device_map="auto", warmup=warmup)
+    return loaded.model, loaded.tokenizer
 
 # 2. Custom stopping to cut off after n numbered steps
+@lru_cache(maxsize=None)
+def _newline_tables(tokenizer):
+    """Per-token-id lookup tables, built once per tokenizer.
+
+    For every vocab id: does it contain a newline, does it carry visible text
+    at all, and is there visible text before the first / after the last newline.
+    """
+    vocab = tokenizer.batch_decode([[i] for i in range(len(tokenizer))])
+    has_nl, content, before, after = [], [], [], []
+    for piece in vocab:
+        has_nl.append("\n" in piece)
+        content.append(bool(piece.strip()))
+        before.append(bool(piece.split("\n", 1)[0].strip()))
+        after.append(bool(piece.rsplit("\n", 1)[-1].strip()))
+    return tuple(torch.tensor(t, dtype=torch.bool) for t in (has_nl, content, before, after))
+
+
 class StopOnNumberedSteps(StoppingCriteria):
-    def __init__(self, tokenizer, max_steps=3):
+    """Stop each row once it has produced ``max_steps`` non-empty lines.
+
+    Only the newly generated ids are inspected at every call and the per-row
+    state (completed steps, "current line has text") is carried over, so the
+    cost per step is O(batch) instead of decoding the whole sequence. Returns
+    a per-row bool tensor so finished rows are frozen in batched generation.
+    Pass ``prompt_length`` when the first call may already see several new
+    tokens (speculative decoding); otherwise it is inferred on the first call.
+    The state belongs to one generation: call :meth:`reset` before reusing
+    the instance for the next one.
+    """
+    def __init__(self, tokenizer, max_steps=3, prompt_length=None):
         self.tokenizer = tokenizer
         self.max_steps = max_steps
+        self.prompt_length = prompt_length
+        self.reset()
+
+    def reset(self):
+        """Forget the previous generation; required before every reuse."""
+        self._seen = None          # number of columns already processed
+        self._steps = None
+        self._line_has_text = None
+        self._done = None
+        self._tables = None
+
     def __call__(self, input_ids, scores, **kwargs):
-        text = self.tokenizer.decode(input_ids[0], skip_special_tokens=True)
-        # stop once we've seen "n." n times (plus the initial newline)
-        return text.count("\n") > self.max_steps
+        if self._seen is not None and (input_ids.shape[1] <= self._seen
+                                       or input_ids.shape[0] != self._steps.shape[0]):
+            raise RuntimeError("StopOnNumberedSteps got a new sequence; call reset() between generations")
+        if self._seen is None:
+            # first call of a generate(): everything but the last column is prompt
+            batch = input_ids.shape[0]
+            self._seen = self.prompt_length if self.prompt_length is not None else input_ids.shape[1] - 1
+            self._steps = torch.zeros(batch, dtype=torch.long, device=input_ids.device)
+            self._line_has_text = torch.zeros(batch, dtype=torch.bool, device=input_ids.device)
+            self._done = torch.zeros(batch, dtype=torch.bool, device=input_ids.device)
+            self._tables = tuple(t.to(input_ids.device) for t in _newline_tables(self.tokenizer))
 
-def generate_cot_outline(question: str,
-                         context: str = "",
-                         n_steps: int = 4,
-                         max_new_tokens: int = 200,
-                         temperature: float = 0.3) -> str:
-    prompt = (
+        has_nl, content, before, after = self._tables
+        for col in range(self._seen, input_ids.shape[1]):
+            ids = input_ids[:, col]
+            nl = has_nl[ids]
+            completes = nl & (self._line_has_text | before[ids]) & ~self._done
+            self._steps += completes.long()
+            self._line_has_text = torch.where(nl, after[ids], self._line_has_text | content[ids])
+            self._done |= self._steps >= self.max_steps
+        self._seen = input_ids.shape[1]
+        return self._done.clone()
+
+def build_cot_prompt(question: str, context: str = "", n_steps: int = 4) -> str:
+    return (
         "You are a helpful reasoning assistant.\n"
         f"Generate a concise {n_steps}-step Chain-of-Thought outline to answer the question below"
         + (f", given the context:\n{context}\n" if context else "\n")
@@ -35,21 +93,128 @@ def generate_cot_outline(question: str,
         "2. …\n"
     )
 
-    inputs = tokenizer(prompt, return_tensors="pt").to(model.device)
-    stopping = StoppingCriteriaList([StopOnNumberedSteps(tokenizer, max_steps=n_steps)])
-    out = model.generate(
-        **inputs,
-        max_new_tokens=max_new_tokens,
-        temperature=temperature,
-        stopping_criteria=stopping,
-        pad_token_id=tokenizer.eos_token_id,
-    )
-    gen = tokenizer.decode(out[0], skip_special_tokens=True)
+def format_cot_outline(gen: str, n_steps: int = 4) -> str:
     # strip off anything before the first "1."
     if "1." in gen:
         gen = gen.split("1.", 1)[1]
-    lines = gen.strip().split("\n")[:n_steps]
+    lines = [line for line in gen.strip().split("\n") if line.strip()][:n_steps]
     numbered = "\n".join(f"{i+1}. {line.strip().lstrip('0123456789. ')}"
                          for i, line in enumerate(lines))
     return "Chain-of-Thought:\n" + numbered
 
+def generate_cot_outlines(questions: Sequence[str],
+                          contexts: Optional[Sequence[str]] = None,
+                          n_steps: int = 4,
+                          max_new_tokens: int = 200,
+                          temperature: float = 0.3,
+                          batch_size: int = 8,
+                          model=None,
+                          tokenizer=None) -> Iterator[Tuple[int, str]]:
+    """Generate outlines for many questions, yielding ``(index, outline)``.
+
+    Prompts are tokenized once, sorted by length and cut into buckets of
+    ``batch_size`` so each bucket is left-padded to a similar width; one
+    ``model.generate`` runs per bucket and its rows are yielded as soon as the
+    bucket finishes (so results arrive out of input order). Any causal LM
+    works, e.g. the tiny GPT checkpoints under LLM-from-Scratch on CPU; when
+    no model is given Falcon is loaded through the registry.
+    """
+    if model is None:
+        model, tokenizer = load_falcon()
+    contexts = contexts if contexts is not None else [""] * len(questions)
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+
+    # small checkpoints have short context windows: only prompts that fill the
+    # window are cut (keeping their tail), and each row's new-token budget is
+    # what its own prompt leaves. Rows the window caps below max_new_tokens
+    # only share a bucket with rows of the same budget (i.e. the same length),
+    # so no output depends on which other prompts it was batched with.
+    limit = getattr(model.config, "max_position_embeddings", None)
+    encoded = [tokenizer(build_cot_prompt(q, c, n_steps))["input_ids"]
+               for q, c in zip(questions, contexts)]
+    if limit:
+        encoded = [ids if len(ids) < limit else ids[-(limit - 1):] for ids in encoded]
+    budgets = [min(max_new_tokens, limit - len(ids)) if limit else max_new_tokens
+               for ids in encoded]
+
+    buckets: List[List[int]] = []
+    for i in sorted(range(len(encoded)), key=lambda i: len(encoded[i])):
+        head = buckets[-1][0] if buckets else None
+        if head is not None and budgets[head] == budgets[i] and len(buckets[-1]) < batch_size:
+            buckets[-1].append(i)
+        else:
+            buckets.append([i])
+
+    stop_on_steps = StopOnNumberedSteps(tokenizer, max_steps=n_steps)
+    for bucket in buckets:
+        width = max(len(encoded[i]) for i in bucket)
+        input_ids = torch.full((len(bucket), width), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(bucket), width), dtype=torch.long)
+        for row, i in enumerate(bucket):
+            ids = encoded[i]
+            input_ids[row, width - len(ids):] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[row, width - len(ids):] = 1
+
+        stop_on_steps.reset()
+        stopping = StoppingCriteriaList([stop_on_steps])
+        out = model.generate(
+            input_ids=input_ids.to(model.device),
+            attention_mask=attention_mask.to(model.device),
+            max_new_tokens=budgets[bucket[0]],
+            temperature=temperature,
+            stopping_criteria=stopping,
+            pad_token_id=pad_id,
+        )
+        texts = tokenizer.batch_decode(out[:, width:], skip_special_tokens=True)
+        for i, gen in zip(bucket, texts):
+            yield i, format_cot_outline(gen, n_steps)
+
+def generate_cot_outline(question: str,
+                         context: str = "",
+                         n_steps: int = 4,
+                         max_new_tokens: int = 200,
+                         temperature: float = 0.3,
+                         draft_model=None,
+                         draft_tokenizer=None,
+                         num_draft_tokens: int = 4) -> str:
+    if draft_model is not None:
+        return generate_cot_outline_speculative(question, context, draft_model, draft_tokenizer,
+                                                n_steps=n_steps, max_new_tokens=max_new_tokens,
+                                                num_draft_tokens=num_draft_tokens)[0]
+    _, outline = next(generate_cot_outlines([question], [context], n_steps=n_steps,
+                                            max_new_tokens=max_new_tokens,
+                                            temperature=temperature))
+    return outline
+
+def generate_cot_outline_speculative(question: str,
+                                     context: str,
+                                     draft_model,
+                                     draft_tokenizer,
+                                     n_steps: int = 4,
+                                     max_new_tokens: int = 200,
+                                     num_draft_tokens: int = 4,
+                                     model=None,
+                                     tokenizer=None,
+                                     measure_baseline: bool = False) -> Tuple[str, SpeculativeStats]:
+    """Outline via speculative decoding: *draft_model* proposes
+    ``num_draft_tokens`` tokens per target forward pass.
+
+    *draft_tokenizer* must match the target's (ValueError otherwise: e.g. the
+    tiny GPT checkpoints cannot draft for Falcon). Decoding is greedy like the
+    standard path, so the outline is identical; returns it together with
+    acceptance rate statistics. ``stats.speedup`` is only filled in with
+    ``measure_baseline=True``, which re-runs plain decoding on the target to
+    time it.
+    """
+    if model is None:
+        model, tokenizer = load_falcon()
+    check_tokenizers_match(tokenizer, draft_tokenizer)
+    input_ids = tokenizer(build_cot_prompt(question, context, n_steps), return_tensors="pt")["input_ids"]
+    input_ids = input_ids.to(model.device)
+    stopping = StopOnNumberedSteps(tokenizer, max_steps=n_steps, prompt_length=input_ids.shape[1])
+    out, stats = speculative_generate(model, draft_model, input_ids, max_new_tokens,
+                                      num_draft_tokens=num_draft_tokens, temperature=0.0,
+                                      eos_token_id=tokenizer.eos_token_id, stopping_criteria=stopping,
+                                      measure_baseline=measure_baseline)
+    gen = tokenizer.decode(out[0, input_ids.shape[1]:], skip_special_tokens=True)
+    return format_cot_outline(gen, n_steps), stats
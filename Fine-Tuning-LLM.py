@@ -36,7 +36,7 @@ print(raw_ds[0])
 # Load policy, reference and tokenizer
 
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
-import torch, copy
+import torch
 
 model_name = "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B"
 bnb = BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype=torch.bfloat16)
@@ -46,15 +46,22 @@ policy = AutoModelForCausalLM.from_pretrained(model_name,
                                               torch_dtype=torch.bfloat16,
                                               device_map="auto")
 
-# A frozen reference network for the KL term
-ref_policy = copy.deepcopy(policy).eval()
-for p in ref_policy.parameters(): p.requires_grad_(False)
+# Train LoRA adapters on top of the frozen 4-bit base. With the adapters
+# disabled the very same weights are the KL reference, so no second copy.
+from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
+
+policy = prepare_model_for_kbit_training(policy)
+policy = get_peft_model(policy, LoraConfig(r=16, lora_alpha=32, lora_dropout=0.05, task_type="CAUSAL_LM",
+                                           target_modules=["q_proj", "k_proj", "v_proj", "o_proj"]))
 
 
 # GRPO trainer implementation
 
 
 import math, random, torch.nn.functional as F
+from model_registry import get_model
+from packing import IGNORE_INDEX, PackedCollator, packed_token_logps, per_sample_sum
+from transformers import LogitsProcessor, LogitsProcessorList
 from trl.trainer import PPOTrainer, PPOConfig
 
 G               = 8          # group size
@@ -62,30 +69,149 @@ CLIP_EPS        = 0.2        # ε in the paper
 KL_BETA         = 0.01       # β in the paper
 MAX_TOKENS      = 512
 BATCH_SIZE      = 16         # = groups per step
+TEMPERATURE     = 0.7
+TOP_P           = 0.95
+PACK_ROLLOUTS   = True       # score rollouts as packed rows instead of padded (B*G, P+T)
+PACK_TOKENS     = 4096       # token budget per packed row
+FORWARD_ROWS    = 1          # rows (rollouts, or packed rows) per scoring forward pass
 
-cfg = PPOConfig(batch_size=BATCH_SIZE, forward_batch_size=1,
+cfg = PPOConfig(batch_size=BATCH_SIZE, forward_batch_size=FORWARD_ROWS,
                 learning_rate=2e-5, log_with=None)
 
+# decoder-only generation needs left padding so every prompt ends at the same column
+tok.padding_side = "left"
+if tok.pad_token is None:
+    tok.pad_token = tok.eos_token
+
+def token_logps(logits, token_ids):
+    """log p(token_ids) under logits; logits has one extra trailing vocab dim.
+
+    Gather minus logsumexp, so no second full-vocab log_softmax tensor is made.
+    """
+    logits = logits.float()
+    picked = torch.gather(logits, -1, token_ids.unsqueeze(-1)).squeeze(-1)
+    return picked - torch.logsumexp(logits, -1)
+
+class OldLogProbRecorder(LogitsProcessor):
+    """Records log p_old of every sampled token while generate() runs.
+
+    At step t the last column of ``input_ids`` is the token sampled at t-1, so
+    its log-prob is gathered from the distribution kept from the previous call:
+    one (rows, V) slice is alive at a time. Custom processors run before the
+    temperature / top-p warpers, so ``scores`` are the raw logits here.
+    """
+
+    def __init__(self, temperature):
+        self.temperature = temperature
+        self.steps = []
+        self._prev = None
+
+    def _gather(self, token_ids):
+        self.steps.append(token_logps(self._prev, token_ids))
+
+    def __call__(self, input_ids, scores):
+        if self._prev is not None:
+            self._gather(input_ids[:, -1])
+        self._prev = scores / self.temperature
+        return scores
+
+    def finish(self, last_ids):
+        """Gather the final sampled token; returns (rows, T) log-probs."""
+        self._gather(last_ids)
+        self._prev = None
+        return torch.stack(self.steps, 1)
+
+def response_mask_from(response_ids, eos_id):
+    """1 for generated tokens up to and including the first EOS, 0 for the padding after it."""
+    is_eos = (response_ids == eos_id).long()
+    return ((is_eos.cumsum(1) - is_eos) == 0).long()
+
 class GRPOTrainer(PPOTrainer):
     @torch.no_grad()
     def generate_group(self, prompts):
-        """Generate G responses per prompt."""
-        all_out, all_logprobs = [], []
-        for _ in range(G):
-            out = self.model.generate(
-                **tok(prompts, return_tensors="pt", padding=True).to(self.model.device),
-                max_new_tokens=MAX_TOKENS,
-                do_sample=True, temperature=0.7, top_p=0.95, eos_token_id=tok.eos_token_id
-            )
-            texts = tok.batch_decode(out[:, :,], skip_special_tokens=True)
-            # log probabilities for ratio πₜ/πₒₗd
-            lp = self.model(**tok(texts, return_tensors="pt", padding=True).to(self.model.device),
-                            labels=tok(texts, return_tensors="pt", padding=True)["input_ids"]).logits
-            logps = -F.cross_entropy(lp[:, :-1].flatten(0,1),
-                                     tok(texts, return_tensors="pt", padding=True)["input_ids"][:,1:].flatten(0,1),
-                                     reduction="none").view(len(texts), -1).sum(1)
-            all_out.append(texts);  all_logprobs.append(logps)
-        return all_out, torch.stack(all_logprobs)
+        """Generate G responses per prompt in a single batched generate call.
+
+        Rows of the returned rollout are ordered prompt-major (row = b*G + g).
+        Old-policy log-probs are recorded during sampling by
+        :class:`OldLogProbRecorder` from the raw logits / TEMPERATURE, the same
+        untruncated distribution :meth:`sequence_logps` scores (the top-p
+        processed scores would bias the PPO ratio). Returns the rollout dict
+        and the summed log-probs with shape (G, B).
+        """
+        enc = tok(prompts, return_tensors="pt", padding=True).to(self.model.device)
+        recorder = OldLogProbRecorder(TEMPERATURE)
+        out = self.model.generate(
+            **enc,
+            max_new_tokens=MAX_TOKENS,
+            do_sample=True, temperature=TEMPERATURE, top_p=TOP_P,
+            num_return_sequences=G,
+            eos_token_id=tok.eos_token_id, pad_token_id=tok.pad_token_id,
+            logits_processor=LogitsProcessorList([recorder]),
+            return_dict_in_generate=True,
+        )
+        prompt_len = enc["input_ids"].shape[1]
+        response_ids = out.sequences[:, prompt_len:]
+        response_mask = response_mask_from(response_ids, tok.eos_token_id)
+        token_lp = torch.where(response_mask.bool(), recorder.finish(response_ids[:, -1]), 0.0)
+
+        texts = tok.batch_decode(response_ids, skip_special_tokens=True)
+        B = len(prompts)
+        rollout = {
+            "texts": [[texts[b * G + g] for b in range(B)] for g in range(G)],
+            "sequences": out.sequences,
+            "attention_mask": torch.cat([enc["attention_mask"].repeat_interleave(G, 0),
+                                         response_mask], dim=1),
+            "response_mask": response_mask,
+            "prompt_len": prompt_len,
+            "token_logps": token_lp,
+        }
+        return rollout, token_lp.sum(1).view(B, G).T
+
+    def sequence_logps(self, rollout, model=None):
+        """Summed response log-probs (G, B) of the sampled ids.
+
+        Runs with gradients, FORWARD_ROWS rollouts per forward pass; prompt and
+        padding positions are masked out. With PACK_ROLLOUTS the padding is
+        dropped and rollouts are packed into PACK_TOKENS-wide rows, scored
+        FORWARD_ROWS packed rows at a time.
+        """
+        model = model or self.model
+        seq, attn, P = rollout["sequences"], rollout["attention_mask"], rollout["prompt_len"]
+        if PACK_ROLLOUTS:
+            return self._packed_sequence_logps(model, rollout)
+        sums = []
+        for i in range(0, seq.shape[0], FORWARD_ROWS):
+            s, a = seq[i:i + FORWARD_ROWS], attn[i:i + FORWARD_ROWS]
+            position_ids = (a.cumsum(1) - 1).clamp_min(0)   # match generate() under left padding
+            logits = model(input_ids=s, attention_mask=a, position_ids=position_ids).logits
+            lp = token_logps(logits[:, P - 1:-1] / TEMPERATURE, s[:, P:])
+            sums.append(torch.where(rollout["response_mask"][i:i + FORWARD_ROWS].bool(), lp, 0.0).sum(1))
+        return torch.cat(sums).view(-1, G).T
+
+    def _packed_sequence_logps(self, model, rollout):
+        seq, attn, P = rollout["sequences"], rollout["attention_mask"], rollout["prompt_len"]
+        labels = seq.clone()
+        labels[:, :P] = IGNORE_INDEX                         # score the response only
+        budget = max(PACK_TOKENS, int(attn.sum(1).max()))    # never truncate a rollout
+        collator = PackedCollator(budget, pad_token_id=tok.pad_token_id, return_sample_index=True,
+                                  dtype=next(model.parameters()).dtype)
+        packed = collator([{"input_ids": s, "labels": l, "attention_mask": m}
+                           for s, l, m in zip(seq.cpu(), labels.cpu(), attn.cpu())])
+        packed = {k: v.to(seq.device) for k, v in packed.items()}
+        sample_index = packed.pop("sample_index")
+        # every sample lives in one packed row, so chunk sums add up to the per-sample totals
+        total = 0
+        for i in range(0, sample_index.shape[0], FORWARD_ROWS):
+            rows = {k: v[i:i + FORWARD_ROWS] for k, v in packed.items()}
+            logits = model(input_ids=rows["input_ids"], attention_mask=rows["attention_mask"],
+                           position_ids=rows["position_ids"]).logits
+            lp = packed_token_logps(logits, rows["input_ids"], rows["labels"], TEMPERATURE)
+            total = total + per_sample_sum(lp, sample_index[i:i + FORWARD_ROWS], seq.shape[0])
+        return total.view(-1, G).T
+
+    def ref_model_logps(self, rollout):
+        """Reference log-probs (G, B) for the KL term; see reference_logps.py."""
+        return self.ref_logps(rollout)
 
     def compute_loss(self, logps, old_logps, advantages, kl_term):
         ratio = torch.exp(logps - old_logps)
@@ -93,7 +219,20 @@ class GRPOTrainer(PPOTrainer):
         clipped   = torch.clamp(ratio, 1-CLIP_EPS, 1+CLIP_EPS) * advantages
         return -torch.mean(torch.min(unclipped, clipped) - KL_BETA * kl_term)
 
-trainer = GRPOTrainer(cfg, policy, ref_policy, tok)
+# Reference log-probs for the KL term: REF_MODE is "adapter" or "cached" (see
+# reference_logps.py); REF_MODEL_PATH optionally points at a separate frozen
+# checkpoint that is memory-mapped through model_registry instead of deep-copied
+from reference_logps import ReferenceLogProbs
+
+REF_MODE        = "adapter"
+REF_MODEL_PATH  = None
+
+# the PEFT policy is its own reference, so trl must not build (copy) another one
+trainer = GRPOTrainer(cfg, policy, None, tok)
+trainer.ref_logps = ReferenceLogProbs(
+    policy, trainer.sequence_logps, mode=REF_MODE,
+    ref_model=get_model(REF_MODEL_PATH).model if REF_MODEL_PATH else None,
+)
 
 
 
@@ -106,8 +245,10 @@ def collate(batch): return {"prompt":[b["prompt"] for b in batch],
 loader = DataLoader(raw_ds.shuffle(seed=42), batch_size=BATCH_SIZE, collate_fn=collate)
 
 for step, batch in enumerate(loader):
-    # 1) Generate G responses
-    outputs, logp_matrix = trainer.generate_group(batch["prompt"])  # shape = (G, B)
+    # 1) Generate G responses (one batched generate) and re-score them with gradients
+    outputs, old_logp_matrix = trainer.generate_group(batch["prompt"])  # shape = (G, B)
+    trainer.ref_logps.precompute(outputs)
+    logp_matrix = trainer.sequence_logps(outputs)                       # shape = (G, B)
     # 2) Slice the reward scores in the same order
     score_matrix = torch.tensor([[r["score"] for r in resp] for resp in batch["responses"]]).T  # (G,B)
 
@@ -117,7 +258,7 @@ for step, batch in enumerate(loader):
 
     # 4) Flatten to feed the optimiser
     loss = trainer.compute_loss(logp_matrix.flatten(),
-                                logp_matrix.detach().flatten(),
+                                old_logp_matrix.flatten(),
                                 advantages.flatten(),
                                 (logp_matrix - trainer.ref_model_logps(outputs)).flatten())
     loss.backward();  trainer.optimizer.step();  trainer.optimizer.zero_grad()
@@ -128,6 +269,7 @@ for step, batch in enumerate(loader):
 
 # Evaluation & saving
 
+# saves the LoRA adapters; merge them into a full-precision base for vLLM / SGLang
 policy.save_pretrained("grpo-qwen7b-strategic")
 tok.save_pretrained("grpo-qwen7b-strategic")
 
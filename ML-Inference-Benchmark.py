@@ -1 +1,275 @@
+'''
+Tiny GPT CPU Benchmark Suite
+Description: Sweeps the Tiny-GPT-ish-LM.yaml geometry (n_embd, n_layer, n_head,
+n_positions), batch size, thread count and sequence length; measures training
+step time / tokens per second, generation latency / throughput with and without
+KV cache, and peak RSS. Results go to JSON; --compare flags regressions against
+a saved baseline.
 
+Usage:  python ML-Inference-Benchmark.py --n-embd 32,128 --batch-sizes 1,8 \\
+            --threads 1,4 --output bench.json --compare baseline.json
+'''
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing as mp
+import platform
+import queue
+import resource
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+# -----------------------------------------------------------------------------
+# Logging configuration
+# -----------------------------------------------------------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+GEOMETRY = ("n_embd", "n_layer", "n_head", "n_positions")
+SWEEP = GEOMETRY + ("batch_size", "threads", "seq_len")
+# metric -> True if higher is better
+METRICS = {
+    "train_step_ms": False,
+    "train_tokens_per_s": True,
+    "gen_cache_latency_ms": False,
+    "gen_cache_tokens_per_s": True,
+    "gen_nocache_latency_ms": False,
+    "gen_nocache_tokens_per_s": True,
+    "peak_rss_mb": False,
+}
+
+# -----------------------------------------------------------------------------
+# Single configuration (runs in its own process)
+# -----------------------------------------------------------------------------
+def _timed(fn, warmup: int, repeats: int) -> float:
+    """Median wall time of *fn* in seconds."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def run_config(point: Dict[str, int], cfg: Dict[str, Any], warmup: int, repeats: int) -> Dict[str, Any]:
+    import torch
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    torch.manual_seed(0)
+    torch.set_num_threads(point["threads"])
+    n_inner = cfg.get("n_inner") if point["n_embd"] == cfg["n_embd"] else None   # default 4 * n_embd
+    config = GPT2Config(
+        vocab_size=cfg["vocab_size"],
+        n_positions=point["n_positions"],
+        n_embd=point["n_embd"],
+        n_layer=point["n_layer"],
+        n_head=point["n_head"],
+        n_inner=n_inner,
+        resid_pdrop=cfg.get("resid_pdrop", 0.0),
+        embd_pdrop=cfg.get("embd_pdrop", 0.0),
+        attn_pdrop=cfg.get("attn_pdrop", 0.0),
+        pad_token_id=cfg["pad_token_id"],
+        eos_token_id=cfg["eos_token_id"],
+        bos_token_id=cfg["bos_token_id"],
+    )
+    model = GPT2LMHeadModel(config)
+    B, T = point["batch_size"], point["seq_len"]
+    ids = torch.randint(0, cfg["vocab_size"], (B, T))
+    result: Dict[str, Any] = {"params": sum(p.numel() for p in model.parameters())}
+
+    # ---- training step ---------------------------------------------------
+    optimizer = torch.optim.AdamW(model.parameters(), lr=cfg["trainer"]["learning_rate"])
+    model.train()
+
+    def train_step():
+        loss = model(input_ids=ids, labels=ids).loss
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+    step = _timed(train_step, warmup, repeats)
+    result["train_step_ms"] = step * 1e3
+    result["train_tokens_per_s"] = B * T / step
+
+    # ---- generation ------------------------------------------------------
+    model.eval()
+    prompt_len = max(1, T // 4)
+    new_tokens = T - prompt_len
+    prompt = ids[:, :prompt_len]
+    for use_cache in (True, False):
+        def generate():
+            with torch.no_grad():
+                model.generate(prompt, attention_mask=torch.ones_like(prompt),
+                               max_new_tokens=new_tokens, min_new_tokens=new_tokens,
+                               do_sample=False, use_cache=use_cache,
+                               pad_token_id=cfg["pad_token_id"])
+        latency = _timed(generate, warmup, repeats)
+        tag = "cache" if use_cache else "nocache"
+        result[f"gen_{tag}_latency_ms"] = latency * 1e3
+        result[f"gen_{tag}_tokens_per_s"] = B * new_tokens / latency
+
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def _worker(point, cfg, warmup, repeats, out) -> None:
+    try:
+        out.put(("ok", run_config(point, cfg, warmup, repeats)))
+    except Exception as e:
+        out.put(("error", f"{type(e).__name__}: {e}"))
+
+# -----------------------------------------------------------------------------
+# Sweep & comparison
+# -----------------------------------------------------------------------------
+def _run_isolated(ctx, point, cfg, warmup: int, repeats: int, timeout: float):
+    """Run one point in a fresh process; a crashed, killed or hung worker is an error."""
+    out = ctx.Queue()
+    proc = ctx.Process(target=_worker, args=(point, cfg, warmup, repeats, out))
+    proc.start()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                return out.get(timeout=1.0)
+            except queue.Empty:
+                pass
+            if not proc.is_alive():
+                try:
+                    return out.get(timeout=1.0)
+                except queue.Empty:
+                    return "error", f"worker exited with code {proc.exitcode}"
+            if time.monotonic() > deadline:
+                proc.kill()
+                return "error", f"timed out after {timeout:.0f}s"
+    finally:
+        proc.join()
+
+
+def sweep(cfg: Dict[str, Any], grid: Dict[str, List[int]], warmup: int, repeats: int,
+          timeout: float = 1800.0) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Run every grid point in a fresh process so peak RSS and threads are isolated.
+
+    Returns the results and the points that were skipped or failed.
+    """
+    ctx = mp.get_context("spawn")
+    results, failures = [], []
+    for values in itertools.product(*(grid[k] for k in SWEEP)):
+        point = dict(zip(SWEEP, values))
+        if point["n_embd"] % point["n_head"] or point["seq_len"] > point["n_positions"]:
+            logger.info("Skipping invalid point %s", point)
+            failures.append({"config": point, "error": "invalid point"})
+            continue
+        status, payload = _run_isolated(ctx, point, cfg, warmup, repeats, timeout)
+        if status != "ok":
+            logger.error("Point %s failed: %s", point, payload)
+            failures.append({"config": point, "error": payload})
+            continue
+        logger.info("%s -> train %.0f tok/s, gen(cache) %.0f tok/s, gen(no cache) %.0f tok/s, %.0f MB",
+                    point, payload["train_tokens_per_s"], payload["gen_cache_tokens_per_s"],
+                    payload["gen_nocache_tokens_per_s"], payload["peak_rss_mb"])
+        results.append({"config": point, "metrics": payload})
+    return results, failures
+
+
+def _key(config: Dict[str, int]) -> str:
+    return ",".join(f"{k}={config[k]}" for k in SWEEP)
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float,
+            failures: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """Return every metric that got worse than baseline by more than *tolerance*.
+
+    A baseline point with no current result (not swept, skipped or failed)
+    is a regression too, with metric ``"missing"``.
+    """
+    base = {_key(r["config"]): r["metrics"] for r in baseline}
+    current = {_key(r["config"]) for r in results}
+    errors = {_key(f["config"]): f["error"] for f in failures or []}
+    regressions = [{"config": r["config"], "metric": "missing",
+                    "error": errors.get(_key(r["config"]), "not in this run")}
+                   for r in baseline if _key(r["config"]) not in current]
+    for r in results:
+        old = base.get(_key(r["config"]))
+        if old is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if metric not in old or not old[metric]:
+                continue
+            change = r["metrics"][metric] / old[metric] - 1
+            worse = change < -tolerance if higher_is_better else change > tolerance
+            if worse:
+                regressions.append({"config": r["config"], "metric": metric, "baseline": old[metric],
+                                    "current": r["metrics"][metric], "change": change})
+    return regressions
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(v) for v in text.split(",") if v]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="CPU training/generation benchmark for the tiny GPT recipe.")
+    parser.add_argument("--config", default="LLM-from-Scratch/Tiny-GPT-ish-LM.yaml")
+    for name in GEOMETRY:
+        parser.add_argument("--" + name.replace("_", "-"), type=_int_list, default=None,
+                            help=f"comma-separated values (default: {name} from the YAML)")
+    parser.add_argument("--batch-sizes", type=_int_list, default=None,
+                        help="default: per_device_train_batch_size from the YAML")
+    parser.add_argument("--threads", type=_int_list, default=[1])
+    parser.add_argument("--seq-lens", type=_int_list, default=None, help="default: n_positions")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=1800.0, help="seconds per grid point")
+    parser.add_argument("--output", default="bench.json")
+    parser.add_argument("--compare", default=None, help="baseline JSON written by an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    with open(args.config) as f:
+        cfg = yaml.safe_load(f)
+    grid = {name: getattr(args, name) or [cfg[name]] for name in GEOMETRY}
+    grid["batch_size"] = args.batch_sizes or [cfg["trainer"]["per_device_train_batch_size"]]
+    grid["threads"] = args.threads
+    grid["seq_len"] = args.seq_lens or grid["n_positions"]
+
+    import torch
+    results, failures = sweep(cfg, grid, args.warmup, args.repeats, args.timeout)
+    report = {
+        "meta": {"python": sys.version.split()[0], "torch": torch.__version__,
+                 "platform": platform.platform(), "processor": platform.processor(),
+                 "cpu_count": mp.cpu_count(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+        "failures": failures,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info("Wrote %d result(s) to %s", len(results), args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance, failures)
+        for r in regressions:
+            if r["metric"] == "missing":
+                print(f"REGRESSION {_key(r['config'])} missing: {r['error']}")
+                continue
+            print(f"REGRESSION {_key(r['config'])} {r['metric']}: "
+                  f"{r['baseline']:.2f} -> {r['current']:.2f} ({r['change'] * 100:+.1f}%)")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.tolerance * 100:.0f}% against {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
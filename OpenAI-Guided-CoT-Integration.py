@@ -1,4 +1,5 @@
-import openai
+from llm_backends import get_backend
+
 def generate_cot_outline(question: str,
                           context: str = "",
                           model: str = "gpt-4",
@@ -23,11 +24,7 @@ def generate_cot_outline(question: str,
         "2. …\n"
     )
 
-    resp = openai.ChatCompletion.create(
-        model=model,
-        messages=[{"role":"system", "content":prompt}],
-        temperature=0.3,
-    )
+    llm = get_backend("openai", model=model)
     # assume the API returns exactly the steps we want
-    steps = resp.choices[0].message.content.strip()
+    steps = llm.complete(prompt, role="system", temperature=0.3).strip()
     return "Chain-of-Thought:\n" + steps
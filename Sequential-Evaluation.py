@@ -0,0 +1,323 @@
+'''
+Sequential Early-Stopping Evaluation for Natural Questions
+Description: Runs the baseline and adversarial NQ conditions side by side and
+stops querying as soon as the confidence intervals for EM / F1 (or the paired
+baseline-vs-adversarial difference) are tight or significant enough.
+
+The stopping rule is re-checked every few examples, so each look spends only
+part of the error budget (Bonferroni over the planned looks, or an
+alpha-spending sequence when there is no cap); the overall false-stop rate
+stays at ``1 - confidence``.
+'''
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import random
+from dataclasses import dataclass, field
+from statistics import NormalDist
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# -----------------------------------------------------------------------------
+# Logging configuration
+# -----------------------------------------------------------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Confidence intervals
+# -----------------------------------------------------------------------------
+def _z(confidence: float) -> float:
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def wilson_interval(successes: float, n: int, confidence: float = 0.95) -> Tuple[float, float]:
+    """Wilson score interval for a binomial proportion (used for EM)."""
+    if n == 0:
+        return 0.0, 1.0
+    z = _z(confidence)
+    p = successes / n
+    denom = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+def normal_interval(values: List[float], confidence: float = 0.95) -> Tuple[float, float]:
+    """Normal-approximation interval for the mean of bounded per-example scores."""
+    n = len(values)
+    if n == 0:
+        return -math.inf, math.inf
+    mean = sum(values) / n
+    if n == 1:
+        return mean, mean
+    var = sum((v - mean) ** 2 for v in values) / (n - 1)
+    half = _z(confidence) * math.sqrt(var / n)
+    return mean - half, mean + half
+
+
+def bootstrap_interval(
+    values: List[float],
+    confidence: float = 0.95,
+    n_resamples: int = 1000,
+    rng: Optional[random.Random] = None,
+) -> Tuple[float, float]:
+    """Percentile bootstrap interval for the mean of *values*.
+
+    Works for bounded per-example scores (F1) as well as paired differences.
+    Very high confidence levels need ``n_resamples`` well above ``1 / (1 - confidence)``.
+    """
+    n = len(values)
+    if n == 0:
+        return -math.inf, math.inf
+    if n == 1:
+        return values[0], values[0]
+    rng = rng or random.Random(0)
+    means = sorted(sum(rng.choices(values, k=n)) / n for _ in range(n_resamples))
+    alpha = (1 - confidence) / 2
+    lo = means[int(math.floor(alpha * (n_resamples - 1)))]
+    hi = means[int(math.ceil((1 - alpha) * (n_resamples - 1)))]
+    return lo, hi
+
+# -----------------------------------------------------------------------------
+# Running estimates
+# -----------------------------------------------------------------------------
+@dataclass
+class MetricEstimate:
+    """Point estimate and confidence interval of one metric."""
+
+    mean: float
+    lower: float
+    upper: float
+
+    @property
+    def width(self) -> float:
+        return self.upper - self.lower
+
+    @property
+    def excludes_zero(self) -> bool:
+        return self.lower > 0 or self.upper < 0
+
+
+@dataclass
+class SequentialEvaluator:
+    """Accumulates paired per-example scores and decides when to stop.
+
+    Args:
+        target_width:    Stop once every marginal EM / F1 interval is narrower
+                         than this (scores are in ``[0, 1]``); ``None`` disables
+                         the width rule.
+        stop_on_significance: Also stop once the paired EM and F1 differences
+                         (adversarial - baseline) both exclude zero.
+        confidence:      Overall two-sided confidence, across all looks.
+        min_examples:    Never stop before this many paired examples.
+        max_examples:    Hard cap on paired examples (``None`` = no cap).
+        check_every:     Re-evaluate the stopping rule every N examples; the
+                         bootstrap is the expensive part, not the bookkeeping.
+        method:          ``"wilson"`` uses Wilson intervals for EM and normal
+                         intervals for F1 and the differences; ``"bootstrap"``
+                         uses the bootstrap for all of them, with at least
+                         ``20 / alpha`` resamples at each look's level.
+        max_resamples:   Cap on bootstrap resamples per interval; a look whose
+                         level would need more falls back to the normal
+                         interval, so late looks cost the same as early ones.
+    """
+
+    target_width: Optional[float] = 0.1
+    stop_on_significance: bool = True
+    confidence: float = 0.95
+    min_examples: int = 20
+    max_examples: Optional[int] = None
+    check_every: int = 5
+    method: str = "wilson"
+    n_resamples: int = 1000
+    max_resamples: int = 20_000
+    seed: int = 0
+    scores: Dict[str, Dict[str, List[float]]] = field(default_factory=lambda: {
+        "baseline": {"em": [], "f1": []},
+        "adversarial": {"em": [], "f1": []},
+    })
+    stop_reason: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        if self.method not in ("wilson", "bootstrap"):
+            raise ValueError(f"Unknown interval method: {self.method!r}")
+        self._rng = random.Random(self.seed)
+
+    # ---------------------------------------------------------------------
+    # Public API
+    # ---------------------------------------------------------------------
+    @property
+    def n(self) -> int:
+        return len(self.scores["baseline"]["em"])
+
+    def update(self, baseline: Tuple[float, float], adversarial: Tuple[float, float]) -> bool:
+        """Record one paired ``(em, f1)`` observation; return True to stop."""
+        for condition, (em, f1) in (("baseline", baseline), ("adversarial", adversarial)):
+            self.scores[condition]["em"].append(float(em))
+            self.scores[condition]["f1"].append(float(f1))
+        return self.should_stop()
+
+    def look_confidence(self, n: Optional[int] = None) -> float:
+        """Per-look confidence level at (or after the last look before) *n* examples.
+
+        With ``max_examples`` the error budget is split evenly over the planned
+        looks (Bonferroni); without a cap look k gets ``alpha * 6 / (pi^2 k^2)``,
+        which sums to ``alpha`` over any number of looks.
+        """
+        n = self.n if n is None else n
+        alpha = 1 - self.confidence
+        first = -(-self.min_examples // self.check_every) * self.check_every
+        if self.max_examples is not None:
+            looks = max(1, len(range(first, self.max_examples, self.check_every)))
+            return 1 - alpha / looks
+        k = max(1, (n - first) // self.check_every + 1)
+        return 1 - alpha * 6 / (math.pi ** 2 * k * k)
+
+    def _interval(self, values: List[float], confidence: float) -> Tuple[float, float]:
+        if self.method == "wilson":
+            return normal_interval(values, confidence)
+        resamples = max(self.n_resamples, math.ceil(20 / (1 - confidence)))
+        if resamples > self.max_resamples:
+            return normal_interval(values, confidence)
+        return bootstrap_interval(values, confidence, resamples, self._rng)
+
+    def marginal(self, condition: str, metric: str, confidence: Optional[float] = None) -> MetricEstimate:
+        confidence = confidence or self.look_confidence()
+        values = self.scores[condition][metric]
+        mean = sum(values) / len(values) if values else 0.0
+        if metric == "em" and self.method == "wilson":
+            lo, hi = wilson_interval(sum(values), len(values), confidence)
+        else:
+            lo, hi = self._interval(values, confidence)
+        return MetricEstimate(mean, lo, hi)
+
+    def difference(self, metric: str, confidence: Optional[float] = None) -> MetricEstimate:
+        """Paired difference ``adversarial - baseline`` for *metric*."""
+        confidence = confidence or self.look_confidence()
+        diffs = [a - b for a, b in zip(self.scores["adversarial"][metric],
+                                       self.scores["baseline"][metric])]
+        mean = sum(diffs) / len(diffs) if diffs else 0.0
+        lo, hi = self._interval(diffs, confidence)
+        return MetricEstimate(mean, lo, hi)
+
+    def should_stop(self) -> bool:
+        n = self.n
+        if self.max_examples is not None and n >= self.max_examples:
+            self.stop_reason = f"reached max_examples={self.max_examples}"
+            return True
+        if n < self.min_examples or n % self.check_every:
+            return False
+
+        if self.stop_on_significance and all(
+            self.difference(metric).excludes_zero for metric in ("em", "f1")
+        ):
+            self.stop_reason = "paired EM and F1 differences are significant"
+            return True
+
+        if self.target_width is None:
+            return False
+        widths = [self.marginal(condition, metric).width
+                  for condition in ("baseline", "adversarial")
+                  for metric in ("em", "f1")]
+        if max(widths) <= self.target_width:
+            self.stop_reason = f"all intervals narrower than {self.target_width}"
+            return True
+        return False
+
+    def summary(self) -> Dict[str, Any]:
+        """Estimates at the last look's level, so they keep their coverage after stopping."""
+        confidence = self.look_confidence()
+        result: Dict[str, Any] = {"examples": self.n, "stop_reason": self.stop_reason,
+                                  "interval_confidence": confidence}
+        for condition in ("baseline", "adversarial"):
+            for metric in ("em", "f1"):
+                result[f"{condition}_{metric}"] = self.marginal(condition, metric, confidence).__dict__
+        for metric in ("em", "f1"):
+            result[f"diff_{metric}"] = self.difference(metric, confidence).__dict__
+        return result
+
+# -----------------------------------------------------------------------------
+# Evaluation loop
+# -----------------------------------------------------------------------------
+def extract_short_answers(example: Dict[str, Any]) -> List[str]:
+    """Collect gold short answers in the same formats the NQ loops accept."""
+    ground_truth_answers: List[str] = []
+    ann = example.get("annotations", [])
+    annotations = ann if isinstance(ann, list) else [ann]
+    for annotation in annotations:
+        if isinstance(annotation, str):
+            try:
+                annotation = json.loads(annotation)
+            except json.JSONDecodeError:
+                continue
+        if not isinstance(annotation, dict):
+            continue
+        for ans in annotation.get("short_answers", []) or []:
+            if isinstance(ans, dict) and ans.get("text"):
+                text = ans["text"]
+                ground_truth_answers.append(text[0] if isinstance(text, list) else text)
+    return [a for a in ground_truth_answers if a.strip()]
+
+
+def run_sequential_evaluation(
+    dataset: Iterable[Dict[str, Any]],
+    query_fn: Callable[[str, str], str],
+    perturb_fn: Callable[[Any], str],
+    exact_fn: Callable[[str, str], float],
+    f1_fn: Callable[[str, str], float],
+    evaluator: Optional[SequentialEvaluator] = None,
+) -> Dict[str, Any]:
+    """Query baseline and perturbed questions until *evaluator* says stop.
+
+    Each usable example costs two queries (one per condition); skipped
+    examples (no gold short answer) cost nothing.
+    """
+    evaluator = evaluator or SequentialEvaluator()
+    queries = 0
+    for example in dataset:
+        answers = extract_short_answers(example)
+        if not answers:
+            continue
+
+        question = example["question"]
+        context = example.get("document_text", "")
+        question_text = question.get("text", str(question)) if isinstance(question, dict) else question
+
+        paired = []
+        for q in (question_text, perturb_fn(question)):
+            pred = query_fn(q, context)
+            queries += 1
+            paired.append((max(exact_fn(gt, pred) for gt in answers),
+                           max(f1_fn(gt, pred) for gt in answers)))
+
+        logger.debug("baseline=%s  adversarial=%s", *paired)
+        if evaluator.update(*paired):
+            break
+    else:
+        evaluator.stop_reason = evaluator.stop_reason or "dataset exhausted"
+
+    result = evaluator.summary()
+    result["queries"] = queries
+    logger.info("Stopped after %d paired examples (%s)", evaluator.n, evaluator.stop_reason)
+    return result
+
+
+if __name__ == '__main__':
+    # Expects the notebook namespace: nq_dataset, query_nova_pro, compute_exact,
+    # compute_f1 and adversarialize_question (see adversarial-qn-Evaluation.py).
+    result = run_sequential_evaluation(
+        nq_dataset,
+        query_fn=query_nova_pro,
+        perturb_fn=adversarialize_question,
+        exact_fn=compute_exact,
+        f1_fn=compute_f1,
+        evaluator=SequentialEvaluator(target_width=0.1, min_examples=20),
+    )
+    print(f"Nova Pro sequential evaluation on Natural Questions ({result['examples']} examples, "
+          f"{result['queries']} queries, stopped: {result['stop_reason']}):")
+    for key in ("baseline_em", "baseline_f1", "adversarial_em", "adversarial_f1", "diff_em", "diff_f1"):
+        est = result[key]
+        print(f"{key:15s} {est['mean'] * 100:7.2f}%  [{est['lower'] * 100:.2f}, {est['upper'] * 100:.2f}]")
@@ -1,6 +1,8 @@
 import logging
 import json
 
+from llm_backends import get_backend
+
 # Configure logging to write detailed debug information to a file.
 logging.basicConfig(
     level=logging.DEBUG,
@@ -18,30 +20,15 @@ AVAILABLE_TOOLS = {
 
 def call_llm(prompt):
     """
-    Mock LLM call.
+    LLM call through the shared backend layer (see llm_backends.py).
 
-    This function simulates an LLM's output.
-    For demonstration, if the prompt contains keywords like "calculate" or "echo",
-    the LLM returns a structured tool call using a special marker ("CALL_TOOL:").
+    The default "mock" backend simulates the LLM's output: if the prompt
+    contains keywords like "calculate" or "echo", it returns a structured tool
+    call using a special marker ("CALL_TOOL:").
 
-    Replace this with your actual LLM API call.
+    Swap the provider passed to get_backend for a real model.
     """
-    if "calculate" in prompt.lower():
-        # Simulate a tool call request for the calculator.
-        tool_call = {
-            "tool": "calculator",
-            "args": {"numbers": [1, 2, 3]}  # Example: a simple sum operation.
-        }
-        return "CALL_TOOL:" + json.dumps(tool_call)
-    elif "echo" in prompt.lower():
-        tool_call = {
-            "tool": "echo",
-            "args": {"message": "Hello from LLM"}
-        }
-        return "CALL_TOOL:" + json.dumps(tool_call)
-    else:
-        # If no tool call is needed, return a final text response.
-        return "Final response from LLM: " + prompt
+    return get_backend("mock").complete(prompt)
 
 def parse_llm_response(response):
     """
@@ -1,5 +1,5 @@
  from transformers import GPT2Config, GPT2LMHeadModel, Trainer, TrainingArguments
-import torch, datasets, json
+import torch, json
 
 # load the YAML
 import yaml, argparse
@@ -14,8 +14,18 @@ model = GPT2LMHeadModel(config)
 # pin <pad> to zero loss
 model.config.pad_token_id = cfg["pad_token_id"]
 
-train_ds = datasets.load_from_disk("train.arrow")
-val_ds   = datasets.load_from_disk("val.arrow")
+# pre-tokenized, memory-mapped token shards (built offline, see token_shards.py):
+#   python token_shards.py --tokenizer tiny-tokenizer.json --bos "<bos>" --out shards/train train.txt
+#   python token_shards.py --tokenizer tiny-tokenizer.json --bos "<bos>" --out shards/val val.txt
+from token_shards import TokenShardDataset
+# contiguous n_positions windows over the token stream: no padding and no
+# truncation, so long documents are trained on in full
+train_ds = TokenShardDataset("shards/train/index.json", block_size=cfg["n_positions"], mode="blocks")
+val_ds   = TokenShardDataset("shards/val/index.json", block_size=cfg["n_positions"], mode="blocks")
+
+# background, deduplicated checkpoints instead of the Trainer's synchronous saves
+from checkpointing import AsyncCheckpointCallback, CheckpointManager
+checkpoints = CheckpointManager("tiny-gpt", keep_last=3, mode="min")
 
 args = TrainingArguments(
         output_dir="tiny-gpt",
@@ -24,7 +34,7 @@ args = TrainingArguments(
         num_train_epochs=cfg["trainer"]["num_train_epochs"],
         learning_rate=cfg["trainer"]["learning_rate"],
         evaluation_strategy="epoch",
-        save_strategy="epoch",
+        save_strategy="no",
         logging_steps=cfg["trainer"]["logging_steps"],
         weight_decay=cfg["trainer"]["weight_decay"],
         lr_scheduler_type=cfg["trainer"]["lr_scheduler_type"],
@@ -33,4 +43,6 @@ args = TrainingArguments(
 Trainer(model=model,
         args=args,
         train_dataset=train_ds,
-        eval_dataset=val_ds).train()
+        eval_dataset=val_ds,
+        callbacks=[AsyncCheckpointCallback(checkpoints, save_steps=cfg["trainer"]["save_steps"])]).train()
+checkpoints.close()
@@ -0,0 +1,375 @@
+'''
+Asynchronous, Deduplicated Checkpointing
+Description: Snapshots training state to CPU memory on the training thread, then
+writes it from a background thread into a content-addressed blob store so
+tensors unchanged since the last save are never written twice. Checkpoint
+directories appear atomically, and only the last k plus the best are kept.
+
+Every checkpoint is also a standard sharded HF checkpoint (one hard-linked blob
+per shard), so ``from_pretrained``, ``Trainer(resume_from_checkpoint=...)``,
+weight_stats.py and Export-Tiny-GPT-ONNX.py read it directly.
+
+Layout:
+    <root>/blobs/<hash>.safetensors     one tensor per blob, shared by checkpoints
+    <root>/checkpoint-N/manifest.json    tensor name -> blob hash, step, metric
+    <root>/checkpoint-N/model-<hash>.safetensors + model.safetensors.index.json + config.json
+    <root>/checkpoint-N/optimizer.pt, scheduler.pt, rng_state.pth, trainer_state.json, tokenizer files
+'''
+
+from __future__ import annotations
+
+import dataclasses
+import glob
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from safetensors.torch import load_file, save_file
+from transformers import TrainerCallback
+
+# -----------------------------------------------------------------------------
+# Logging configuration
+# -----------------------------------------------------------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------------------------
+def _to_cpu(obj: Any) -> Any:
+    """Deep copy of a (nested) state dict with every tensor cloned to CPU."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def tensor_hash(name: str, t: torch.Tensor) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{name}{t.dtype}{tuple(t.shape)}".encode())
+    if t.numel():
+        h.update(t.contiguous().view(-1).view(torch.uint8).numpy())
+    return h.hexdigest()
+
+
+def _fsync(path: str) -> None:
+    """Flush a file, or a directory entry table, to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_json(path: str, data: Any) -> None:
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def _rng_state() -> Dict[str, Any]:
+    """Same keys and layout as the Trainer's rng_state.pth."""
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "cpu": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = (torch.cuda.get_rng_state_all() if torch.cuda.device_count() > 1
+                         else torch.cuda.get_rng_state())
+    return state
+
+# -----------------------------------------------------------------------------
+# Checkpoint manager
+# -----------------------------------------------------------------------------
+class CheckpointManager:
+    """Background-writing, content-deduplicated checkpoint store.
+
+    Args:
+        root:        Output directory (e.g. ``LLM-from-Scratch``).
+        keep_last:   Number of most recent checkpoints to keep.
+        mode:        ``"min"`` or ``"max"``: which metric value is "best".
+        async_write: Write in a background thread (one save in flight; a new
+                     save waits for the previous write before snapshotting).
+        skip_unchanged: Reuse the previous hash of a tensor whose storage and
+                     autograd version counter are unchanged, without copying or
+                     hashing it. Off by default: writes through ``.data`` or
+                     ``torch.no_grad()`` views can bypass the version counter.
+    """
+
+    def __init__(self, root: str, keep_last: int = 3, mode: str = "min", async_write: bool = True,
+                 skip_unchanged: bool = False) -> None:
+        if mode not in ("min", "max"):
+            raise ValueError(f"Unknown mode: {mode!r}")
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.keep_last = keep_last
+        self.mode = mode
+        self.async_write = async_write
+        self.skip_unchanged = skip_unchanged
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._remove_partial_writes()
+
+        # name -> (data_ptr, version, hash) of the last snapshot (see skip_unchanged)
+        self._last: Dict[str, Tuple[int, int, str]] = {}
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=1)
+        self._idle = threading.Event()
+        self._idle.set()
+        self._error: Optional[BaseException] = None
+        self._thread: Optional[threading.Thread] = None
+        if async_write:
+            self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+            self._thread.start()
+
+    # ---------------------------------------------------------------------
+    # Public API
+    # ---------------------------------------------------------------------
+    def save(self, step: int, model: torch.nn.Module, optimizer: Any = None, scheduler: Any = None,
+             metric: Optional[float] = None, tokenizer: Any = None,
+             trainer_state: Optional[Dict[str, Any]] = None) -> None:
+        """Snapshot state now; write it now (sync) or in the background (async)."""
+        self.wait()
+        t0 = time.perf_counter()
+        tensors, hashes = {}, {}
+        for name, t in model.state_dict().items():
+            last = self._last.get(name)
+            if self.skip_unchanged and last is not None and last[:2] == (t.data_ptr(), t._version):
+                hashes[name] = last[2]
+            else:
+                tensors[name] = (t.detach().to("cpu", copy=True), t.data_ptr(), t._version)
+        job = {
+            "step": step,
+            "metric": metric,
+            "tensors": tensors,
+            "hashes": hashes,
+            "optimizer": _to_cpu(optimizer.state_dict()) if optimizer is not None else None,
+            "scheduler": scheduler.state_dict() if scheduler is not None else None,
+            "rng": _rng_state(),
+            "tokenizer": tokenizer,
+            "config": model.config.to_dict() if hasattr(model, "config") else None,
+            "trainer_state": trainer_state,
+        }
+        logger.info("Checkpoint %d: snapshot took %.3fs (%d changed tensor(s), %d reused)",
+                    step, time.perf_counter() - t0, len(tensors), len(hashes))
+        if self.async_write:
+            self._idle.clear()
+            self._queue.put(job)
+        else:
+            self._write(job)
+
+    def wait(self) -> None:
+        """Block until the in-flight write (if any) is on disk; re-raise its error."""
+        self._idle.wait()
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Background checkpoint write failed") from error
+
+    def close(self) -> None:
+        self.wait()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def checkpoints(self) -> List[Dict[str, Any]]:
+        """Manifests of all complete checkpoints, oldest first."""
+        found = []
+        for entry in os.listdir(self.root):
+            path = os.path.join(self.root, entry, "manifest.json")
+            if entry.startswith("checkpoint-") and os.path.isfile(path):
+                with open(path) as f:
+                    found.append({**json.load(f), "path": os.path.join(self.root, entry)})
+        return sorted(found, key=lambda m: m["step"])
+
+    def best(self) -> Optional[Dict[str, Any]]:
+        scored = [m for m in self.checkpoints() if m.get("metric") is not None]
+        if not scored:
+            return None
+        pick = min if self.mode == "min" else max
+        return pick(scored, key=lambda m: m["metric"])
+
+    def load(self, model: torch.nn.Module, optimizer: Any = None, scheduler: Any = None,
+             which: str = "latest") -> Dict[str, Any]:
+        """Restore ``"latest"``, ``"best"`` or a checkpoint directory path."""
+        self.wait()
+        if which in ("latest", "best"):
+            manifests = self.checkpoints()
+            manifest = (manifests[-1] if manifests else None) if which == "latest" else self.best()
+            if manifest is None:
+                raise FileNotFoundError(f"No {which} checkpoint under {self.root}")
+            path = manifest["path"]
+        else:
+            path = which
+            with open(os.path.join(path, "manifest.json")) as f:
+                manifest = json.load(f)
+
+        state = {name: load_file(self._blob_path(h))[name] for name, h in manifest["tensors"].items()}
+        model.load_state_dict(state, strict=False)
+        if optimizer is not None and os.path.exists(os.path.join(path, "optimizer.pt")):
+            optimizer.load_state_dict(torch.load(os.path.join(path, "optimizer.pt"), weights_only=False))
+        if scheduler is not None and os.path.exists(os.path.join(path, "scheduler.pt")):
+            scheduler.load_state_dict(torch.load(os.path.join(path, "scheduler.pt"), weights_only=False))
+        rng = torch.load(os.path.join(path, "rng_state.pth"), weights_only=False)
+        random.setstate(rng["python"])
+        np.random.set_state(rng["numpy"])
+        torch.set_rng_state(rng["cpu"])
+        if "cuda" in rng and torch.cuda.is_available():
+            if isinstance(rng["cuda"], (list, tuple)):
+                torch.cuda.set_rng_state_all(rng["cuda"])
+            else:
+                torch.cuda.set_rng_state(rng["cuda"])
+        self._last.clear()
+        return manifest
+
+    # ---------------------------------------------------------------------
+    # Writer
+    # ---------------------------------------------------------------------
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self._write(job)
+            except BaseException as e:
+                logger.exception("Checkpoint %d failed", job["step"])
+                self._error = e
+            finally:
+                self._idle.set()
+
+    def _blob_path(self, h: str) -> str:
+        return os.path.join(self.blob_dir, h + ".safetensors")
+
+    def _remove_partial_writes(self) -> None:
+        """Drop temp directories and blobs left behind by an interrupted write."""
+        for path in glob.glob(os.path.join(self.root, ".checkpoint-*.tmp")):
+            shutil.rmtree(path, ignore_errors=True)
+        for path in glob.glob(os.path.join(self.blob_dir, "*.tmp")):
+            os.remove(path)
+
+    def _write(self, job: Dict[str, Any]) -> None:
+        t0 = time.perf_counter()
+        step = job["step"]
+        final = os.path.join(self.root, f"checkpoint-{step}")
+        tmp = os.path.join(self.root, f".checkpoint-{step}.tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        hashes = dict(job["hashes"])
+        written = 0
+        for name, (tensor, ptr, version) in job["tensors"].items():
+            h = tensor_hash(name, tensor)
+            hashes[name] = h
+            blob = self._blob_path(h)
+            if not os.path.exists(blob):
+                save_file({name: tensor.contiguous()}, blob + ".tmp")
+                _fsync(blob + ".tmp")
+                os.replace(blob + ".tmp", blob)
+                written += 1
+            self._last[name] = (ptr, version, h)
+        _fsync(self.blob_dir)
+
+        # standard sharded HF layout: each blob hard-linked in as one shard
+        weight_map = {}
+        for name, h in hashes.items():
+            shard = f"model-{h}.safetensors"
+            weight_map[name] = shard
+            try:
+                os.link(self._blob_path(h), os.path.join(tmp, shard))
+            except OSError:     # no hard links on this filesystem
+                shutil.copyfile(self._blob_path(h), os.path.join(tmp, shard))
+        total_size = sum(os.path.getsize(self._blob_path(h)) for h in set(hashes.values()))
+        _write_json(os.path.join(tmp, "model.safetensors.index.json"),
+                    {"metadata": {"total_size": total_size}, "weight_map": weight_map})
+        if job["config"] is not None:
+            _write_json(os.path.join(tmp, "config.json"), job["config"])
+        if job["trainer_state"] is not None:
+            _write_json(os.path.join(tmp, "trainer_state.json"), job["trainer_state"])
+
+        if job["optimizer"] is not None:
+            torch.save(job["optimizer"], os.path.join(tmp, "optimizer.pt"))
+        if job["scheduler"] is not None:
+            torch.save(job["scheduler"], os.path.join(tmp, "scheduler.pt"))
+        torch.save(job["rng"], os.path.join(tmp, "rng_state.pth"))
+        if job["tokenizer"] is not None:
+            job["tokenizer"].save_pretrained(tmp)
+        _write_json(os.path.join(tmp, "manifest.json"),
+                    {"step": step, "metric": job["metric"], "tensors": hashes})
+        for entry in os.listdir(tmp):
+            _fsync(os.path.join(tmp, entry))
+        _fsync(tmp)
+
+        # the directory only becomes visible once complete
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(tmp, final)
+        _fsync(self.root)
+        self._prune()
+        logger.info("Checkpoint %d written in %.3fs (%d new blob(s), %d deduplicated)",
+                    step, time.perf_counter() - t0, written, len(hashes) - written)
+
+    def _prune(self) -> None:
+        manifests = self.checkpoints()
+        keep = {m["path"] for m in manifests[-self.keep_last:]}
+        best = self.best()
+        if best is not None:
+            keep.add(best["path"])
+        for m in manifests:
+            if m["path"] not in keep:
+                shutil.rmtree(m["path"], ignore_errors=True)
+
+        live = {h for m in manifests if m["path"] in keep for h in m["tensors"].values()}
+        live.update(h for _, _, h in self._last.values())
+        for blob in os.listdir(self.blob_dir):
+            if blob.endswith(".safetensors") and blob[:-len(".safetensors")] not in live:
+                os.remove(os.path.join(self.blob_dir, blob))
+
+# -----------------------------------------------------------------------------
+# Trainer integration
+# -----------------------------------------------------------------------------
+class AsyncCheckpointCallback(TrainerCallback):
+    """Save through a :class:`CheckpointManager` every ``save_steps`` steps.
+
+    Use with ``TrainingArguments(save_strategy="no")`` so the Trainer's own
+    synchronous saving is off. The Trainer evaluates after ``on_step_end``, so
+    a save step is held until the weights are about to change: an evaluation
+    at that step attaches its ``eval_<metric>`` as the "best" key, otherwise
+    the checkpoint is saved unscored.
+    """
+
+    def __init__(self, manager: CheckpointManager, save_steps: int, metric: str = "loss",
+                 tokenizer: Any = None) -> None:
+        self.manager = manager
+        self.save_steps = save_steps
+        self.metric = metric
+        self.tokenizer = tokenizer
+        self._pending: Optional[int] = None
+
+    def _save_pending(self, state, metric: Optional[float] = None, model=None, optimizer=None,
+                      lr_scheduler=None, **kwargs) -> None:
+        if self._pending is None:
+            return
+        self._pending = None
+        self.manager.save(state.global_step, model, optimizer, lr_scheduler,
+                          metric=metric, tokenizer=self.tokenizer,
+                          trainer_state=dataclasses.asdict(state))
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if state.global_step % self.save_steps == 0:
+            self._pending = state.global_step
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        self._save_pending(state, metric=(metrics or {}).get(f"eval_{self.metric}"), **kwargs)
+
+    def on_step_begin(self, args, state, control, **kwargs):
+        self._save_pending(state, **kwargs)
+
+    def on_train_end(self, args, state, control, **kwargs):
+        self._save_pending(state, **kwargs)
+        self.manager.wait()
@@ -0,0 +1,305 @@
+'''
+Unified LLM Backends
+Description: One interface for every model we call (OpenAI, Bedrock, local HF,
+mock). Each backend keeps a pooled, persistent client and coalesces identical
+concurrent requests into a single in-flight call, and exposes the same
+sync / async / streaming / batch surface.
+'''
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import json
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Type
+
+# -----------------------------------------------------------------------------
+# Logging configuration
+# -----------------------------------------------------------------------------
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Base class
+# -----------------------------------------------------------------------------
+class LLMBackend(ABC):
+    """Base class: subclasses implement :meth:`_complete` (and optionally
+    :meth:`_stream`); everything else is shared.
+
+    Args:
+        model:       Provider-specific model id.
+        max_workers: Size of the thread pool used by :meth:`acomplete` and
+                     :meth:`batch`; also the connection-pool size of clients.
+        defaults:    Default generation parameters merged into every call.
+    """
+
+    name = "base"
+
+    def __init__(self, model: Optional[str] = None, max_workers: int = 8, **defaults: Any) -> None:
+        self.model = model
+        self.max_workers = max_workers
+        self.defaults = defaults
+        self.stats = {"requests": 0, "calls": 0, "coalesced": 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix=f"llm-{self.name}")
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    # ---------------------------------------------------------------------
+    # Provider hooks
+    # ---------------------------------------------------------------------
+    @abstractmethod
+    def _complete(self, prompt: str, **params: Any) -> str:
+        """Run one provider call and return the completion text."""
+
+    def _stream(self, prompt: str, **params: Any) -> Iterator[str]:
+        yield self._complete(prompt, **params)
+
+    # ---------------------------------------------------------------------
+    # Public API
+    # ---------------------------------------------------------------------
+    def complete(self, prompt: str, **params: Any) -> str:
+        """Return the completion for *prompt*.
+
+        If the same prompt with the same parameters is already in flight, wait
+        for that call instead of issuing a second one.
+        """
+        params = {**self.defaults, **params}
+        key = json.dumps([prompt, params], sort_keys=True, default=str)
+        with self._lock:
+            self.stats["requests"] += 1
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self.stats["calls"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        if not owner:
+            return future.result()
+
+        try:
+            result = self._complete(prompt, **params)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def acomplete(self, prompt: str, **params: Any) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self.complete, prompt, **params))
+
+    def stream(self, prompt: str, **params: Any) -> Iterator[str]:
+        """Yield the completion in chunks as the provider produces them."""
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["calls"] += 1
+        yield from self._stream(prompt, **{**self.defaults, **params})
+
+    async def astream(self, prompt: str, **params: Any) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        chunks = self.stream(prompt, **params)
+        sentinel = object()
+        while True:
+            chunk = await loop.run_in_executor(self._executor, next, chunks, sentinel)
+            if chunk is sentinel:
+                return
+            yield chunk
+
+    def batch(self, prompts: Sequence[str], **params: Any) -> List[str]:
+        """Complete many prompts concurrently, preserving order."""
+        return list(self._executor.map(functools.partial(self.complete, **params), prompts))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+# -----------------------------------------------------------------------------
+# Providers
+# -----------------------------------------------------------------------------
+def toolformer_mock_response(prompt: str) -> str:
+    """Deterministic stand-in that emits Toolformer-style tool calls."""
+    if "calculate" in prompt.lower():
+        return "CALL_TOOL:" + json.dumps({"tool": "calculator", "args": {"numbers": [1, 2, 3]}})
+    if "echo" in prompt.lower():
+        return "CALL_TOOL:" + json.dumps({"tool": "echo", "args": {"message": "Hello from LLM"}})
+    return "Final response from LLM: " + prompt
+
+
+class MockBackend(LLMBackend):
+    """Offline backend driven by a Python function (no network, no model)."""
+
+    name = "mock"
+
+    def __init__(self, responder: Callable[[str], str] = toolformer_mock_response,
+                 latency: float = 0.0, **kwargs: Any) -> None:
+        super().__init__(model="mock", **kwargs)
+        self.responder = responder
+        self.latency = latency
+
+    def _complete(self, prompt: str, **params: Any) -> str:
+        if self.latency:
+            threading.Event().wait(self.latency)
+        return self.responder(prompt)
+
+    def _stream(self, prompt: str, **params: Any) -> Iterator[str]:
+        words = self._complete(prompt, **params).split(" ")
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + " "
+
+
+class OpenAIBackend(LLMBackend):
+    """OpenAI chat completions through one long-lived, pooled client."""
+
+    name = "openai"
+
+    def __init__(self, model: str = "gpt-4", **kwargs: Any) -> None:
+        super().__init__(model=model, **kwargs)
+        import openai
+
+        if hasattr(openai, "OpenAI"):
+            import httpx
+
+            limits = httpx.Limits(max_connections=self.max_workers,
+                                  max_keepalive_connections=self.max_workers)
+            self._client = openai.OpenAI(http_client=httpx.Client(limits=limits))
+        else:  # openai<1.0: module-level API with its own requests session
+            self._client = None
+            self._openai = openai
+
+    def _create(self, prompt: str, role: str = "user", **params: Any):
+        messages = [{"role": role, "content": prompt}]
+        if self._client is not None:
+            return self._client.chat.completions.create(model=self.model, messages=messages, **params)
+        return self._openai.ChatCompletion.create(model=self.model, messages=messages, **params)
+
+    def _complete(self, prompt: str, **params: Any) -> str:
+        return self._create(prompt, **params).choices[0].message.content
+
+    def _stream(self, prompt: str, **params: Any) -> Iterator[str]:
+        for chunk in self._create(prompt, stream=True, **params):
+            delta = chunk.choices[0].delta if chunk.choices else None
+            content = delta.content if self._client is not None else (delta or {}).get("content")
+            if content:
+                yield content
+
+
+class BedrockBackend(LLMBackend):
+    """AWS Bedrock ``invoke_model`` with a shared, connection-pooled client."""
+
+    name = "bedrock"
+
+    def __init__(self, model: str = "meta.llama3-1-405b-instruct-v1:0",
+                 region_name: str = "us-east-1", **kwargs: Any) -> None:
+        super().__init__(model=model, **kwargs)
+        import boto3
+        from botocore.config import Config
+
+        self._client = boto3.client(
+            "bedrock-runtime", region_name=region_name,
+            config=Config(max_pool_connections=self.max_workers, retries={"mode": "adaptive"}),
+        )
+
+    def _complete(self, prompt: str, **params: Any) -> str:
+        response = self._client.invoke_model(
+            modelId=self.model,
+            body=json.dumps({"prompt": prompt, **params}),
+            contentType="application/json",
+        )
+        result = json.loads(response["body"].read())
+        return (result.get("generation") or result.get("generated_text", "")).strip()
+
+    def _stream(self, prompt: str, **params: Any) -> Iterator[str]:
+        response = self._client.invoke_model_with_response_stream(
+            modelId=self.model,
+            body=json.dumps({"prompt": prompt, **params}),
+            contentType="application/json",
+        )
+        for event in response["body"]:
+            chunk = json.loads(event["chunk"]["bytes"])
+            text = chunk.get("generation") or chunk.get("generated_text")
+            if text:
+                yield text
+
+
+class HFBackend(LLMBackend):
+    """Local Hugging Face causal LM, loaded once through the model registry."""
+
+    name = "hf"
+
+    def __init__(self, model: str, dtype: Optional[str] = None, device_map: Optional[str] = None,
+                 **kwargs: Any) -> None:
+        super().__init__(model=model, **kwargs)
+        import torch
+        from model_registry import get_model
+
+        self._torch = torch
+        loaded = get_model(model, dtype=getattr(torch, dtype) if dtype else torch.float32,
+                           device_map=device_map)
+        self._model, self._tokenizer = loaded.model, loaded.tokenizer
+
+    def _inputs(self, prompt: str):
+        return self._tokenizer(prompt, return_tensors="pt").to(self._model.device)
+
+    def _generate_kwargs(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        pad_id = self._tokenizer.pad_token_id
+        return {"max_new_tokens": 128,
+                "pad_token_id": pad_id if pad_id is not None else self._tokenizer.eos_token_id,
+                **params}
+
+    def _complete(self, prompt: str, **params: Any) -> str:
+        inputs = self._inputs(prompt)
+        with self._torch.no_grad():
+            out = self._model.generate(**inputs, **self._generate_kwargs(params))
+        return self._tokenizer.decode(out[0, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+
+    def _stream(self, prompt: str, **params: Any) -> Iterator[str]:
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(self._tokenizer, skip_prompt=True, skip_special_tokens=True)
+        kwargs = {**self._inputs(prompt), **self._generate_kwargs(params), "streamer": streamer}
+        thread = threading.Thread(target=self._model.generate, kwargs=kwargs, daemon=True)
+        thread.start()
+        yield from streamer
+        thread.join()
+
+# -----------------------------------------------------------------------------
+# Backend registry
+# -----------------------------------------------------------------------------
+BACKENDS: Dict[str, Type[LLMBackend]] = {
+    "mock": MockBackend,
+    "openai": OpenAIBackend,
+    "bedrock": BedrockBackend,
+    "hf": HFBackend,
+}
+
+_instances: Dict[Tuple[str, Tuple[Tuple[str, Any], ...]], LLMBackend] = {}
+_instances_lock = threading.Lock()
+
+
+def register_backend(name: str, cls: Type[LLMBackend]) -> None:
+    BACKENDS[name] = cls
+
+
+def get_backend(provider: str, **kwargs: Any) -> LLMBackend:
+    """Return the shared backend for *provider* and *kwargs*, creating it once.
+
+    Reusing the instance is what keeps its client pool and in-flight table
+    shared across callers.
+    """
+    if provider not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend {provider!r}; available: {sorted(BACKENDS)}")
+    key = (provider, tuple(sorted(kwargs.items())))
+    with _instances_lock:
+        backend = _instances.get(key)
+        if backend is None:
+            backend = _instances[key] = BACKENDS[provider](**kwargs)
+            logger.info("Created %s backend (model=%s)", provider, backend.model)
+    return backend
@@ -0,0 +1,218 @@
+'''
+Lazy Model Registry
+Description: Loads causal LMs on first use, caches them by (name, dtype, device
+map) and, for local safetensors checkpoints on CPU, maps the weight files
+straight into the parameters so several worker processes share the same pages.
+'''
+
+from __future__ import annotations
+
+import contextlib
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+try:
+    from transformers.modeling_utils import no_init_weights
+except ImportError:  # very old transformers: fall back to (wasted) random init
+    no_init_weights = contextlib.nullcontext
+
+# -----------------------------------------------------------------------------
+# Logging configuration
+# -----------------------------------------------------------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# safetensors memory mapping
+# -----------------------------------------------------------------------------
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+
+def read_safetensors_header(path: str) -> Tuple[Dict[str, Any], int]:
+    """Return the JSON header of a ``.safetensors`` file and the data offset."""
+    with open(path, "rb") as f:
+        (header_len,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_len))
+    header.pop("__metadata__", None)
+    return header, 8 + header_len
+
+
+def mmap_safetensors(path: str) -> Tuple[Dict[str, torch.Tensor], mmap.mmap]:
+    """Map *path* copy-on-write and return tensors that view the mapping.
+
+    No bytes are read until a tensor is touched, and untouched pages stay shared
+    with every other process mapping the same file. The returned ``mmap`` must
+    outlive the tensors.
+    """
+    header, data_start = read_safetensors_header(path)
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    tensors = {}
+    for name, info in header.items():
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        shape = info["shape"]
+        start, end = info["data_offsets"]
+        numel = 1
+        for dim in shape:
+            numel *= dim
+        if numel == 0:
+            tensors[name] = torch.empty(shape, dtype=dtype)
+            continue
+        tensors[name] = torch.frombuffer(mm, dtype=dtype, count=numel,
+                                         offset=data_start + start).view(shape)
+    return tensors, mm
+
+# -----------------------------------------------------------------------------
+# Registry
+# -----------------------------------------------------------------------------
+@dataclass
+class LoadedModel:
+    """A cached model/tokenizer pair plus how long it took to get ready."""
+
+    name: str
+    model: Any
+    tokenizer: Any
+    load_seconds: float
+    mmapped: bool = False
+    warmup_seconds: Optional[float] = None
+    _mappings: List[mmap.mmap] = field(default_factory=list, repr=False)
+
+
+class ModelRegistry:
+    """Process-wide cache of causal LMs, loaded on first :meth:`get`."""
+
+    def __init__(self) -> None:
+        self._models: Dict[Tuple[str, str, str], LoadedModel] = {}
+        self._lock = threading.Lock()
+
+    # ---------------------------------------------------------------------
+    # Public API
+    # ---------------------------------------------------------------------
+    def get(
+        self,
+        name: str,
+        dtype: torch.dtype = torch.float32,
+        device_map: Optional[str] = None,
+        warmup: bool = False,
+        **kwargs: Any,
+    ) -> LoadedModel:
+        """Return the cached model for *name*, loading it if needed.
+
+        Local directories with ``*.safetensors`` weights loaded onto the CPU are
+        memory-mapped; everything else goes through ``from_pretrained``.
+        """
+        key = (name, str(dtype), str(device_map))
+        with self._lock:
+            entry = self._models.get(key)
+            if entry is None:
+                entry = self._load(name, dtype, device_map, **kwargs)
+                self._models[key] = entry
+        if warmup and entry.warmup_seconds is None:
+            self.warmup(entry)
+        return entry
+
+    def warmup(self, entry: LoadedModel) -> float:
+        """Run one tiny forward pass so lazy kernels/pages are ready."""
+        tok = entry.tokenizer
+        start_id = next((i for i in (tok.bos_token_id, tok.eos_token_id) if i is not None), 0)
+        device = next(entry.model.parameters()).device
+        t0 = time.perf_counter()
+        with torch.no_grad():
+            entry.model(input_ids=torch.tensor([[start_id]], device=device))
+        entry.warmup_seconds = time.perf_counter() - t0
+        logger.info("Warm-up of %s took %.3fs", entry.name, entry.warmup_seconds)
+        return entry.warmup_seconds
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [{"name": e.name, "dtype": key[1], "device_map": key[2],
+                 "load_seconds": e.load_seconds, "warmup_seconds": e.warmup_seconds,
+                 "mmapped": e.mmapped}
+                for key, e in self._models.items()]
+
+    def evict(self, name: str) -> None:
+        with self._lock:
+            for key in [k for k in self._models if k[0] == name]:
+                del self._models[key]
+
+    # ---------------------------------------------------------------------
+    # Loading
+    # ---------------------------------------------------------------------
+    def _load(self, name: str, dtype: torch.dtype, device_map: Optional[str], **kwargs: Any) -> LoadedModel:
+        t0 = time.perf_counter()
+        tokenizer = AutoTokenizer.from_pretrained(name, **kwargs)
+        files = sorted(glob.glob(os.path.join(name, "*.safetensors"))) if os.path.isdir(name) else []
+        if files and device_map in (None, "cpu"):
+            model, mappings = self._load_mmapped(name, files, dtype, **kwargs)
+        else:
+            model, mappings = AutoModelForCausalLM.from_pretrained(
+                name, torch_dtype=dtype, device_map=device_map,
+                low_cpu_mem_usage=True, **kwargs), []
+        model.eval()
+        entry = LoadedModel(name, model, tokenizer, time.perf_counter() - t0,
+                            mmapped=bool(mappings), _mappings=mappings)
+        logger.info("Loaded %s in %.3fs (%s)", name, entry.load_seconds,
+                    "memory-mapped" if entry.mmapped else "from_pretrained")
+        return entry
+
+    @staticmethod
+    def _load_mmapped(path: str, files: List[str], dtype: torch.dtype, **kwargs: Any):
+        config = AutoConfig.from_pretrained(path, **kwargs)
+        with no_init_weights():
+            # parameters are torch.empty: their pages are never touched before
+            # being replaced by the mapped tensors below
+            model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype)
+
+        state, mappings = {}, []
+        for file in files:
+            tensors, mm = mmap_safetensors(file)
+            state.update(tensors)
+            mappings.append(mm)
+        converted = [k for k, t in state.items() if t.is_floating_point() and t.dtype != dtype]
+        if converted:
+            logger.warning("%d tensor(s) in %s are not %s and will be copied, not shared",
+                           len(converted), path, dtype)
+            for k in converted:
+                state[k] = state[k].to(dtype)
+
+        missing, unexpected = model.load_state_dict(state, strict=False, assign=True)
+        model.tie_weights()
+        tied = set(getattr(model, "_tied_weights_keys", None) or [])
+        missing = [k for k in missing if k not in tied]
+        if missing or unexpected:
+            raise ValueError(f"Checkpoint {path} does not match its config: "
+                             f"missing={missing} unexpected={unexpected}")
+        return model, mappings
+
+
+registry = ModelRegistry()
+
+
+def get_model(name: str, **kwargs: Any) -> LoadedModel:
+    """Shortcut for ``registry.get`` on the process-wide registry."""
+    return registry.get(name, **kwargs)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Load a model through the registry and report timings.")
+    parser.add_argument("name", help="hub id or local checkpoint directory")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16", "bfloat16"])
+    args = parser.parse_args()
+    get_model(args.name, dtype=getattr(torch, args.dtype), warmup=True)
+    print(json.dumps(registry.stats(), indent=2))
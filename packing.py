@@ -0,0 +1,202 @@
+'''
+Padding-Free Sequence Packing
+Description: Collator that packs variable-length samples into fixed token-budget
+rows (position ids and attention reset at every sample boundary) plus helpers to
+reduce per-token values back to per-sample sums. Works as a ``Trainer``
+``data_collator`` and for scoring GRPO rollouts.
+
+Models must be prepared with :func:`prepare_model_for_packing` first: GPT-2
+flattens ``attention_mask`` to 2D, so its block mask is routed to an SDPA
+attention function instead, and ``"flash"`` rows are only isolated by
+FlashAttention-2.
+'''
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Sequence
+
+import torch
+from transformers import AttentionInterface
+from transformers.integrations.sdpa_attention import sdpa_attention_forward
+
+IGNORE_INDEX = -100
+PACKED_ATTENTION = "packed_sdpa"
+# model types whose base forward reshapes attention_mask to (batch, seq_len)
+FLAT_MASK_MODELS = {"gpt2"}
+
+
+def _as_list(x: Any) -> List[int]:
+    return x.tolist() if isinstance(x, torch.Tensor) else list(x)
+
+
+class PackedCollator:
+    """Pack samples into rows of at most ``max_tokens`` tokens.
+
+    Each feature needs ``input_ids`` and may carry ``labels`` (defaults to the
+    inputs) and ``attention_mask`` (zeros are padding and get stripped, so
+    already-padded datasets can be packed as-is). Samples are placed
+    first-fit-decreasing; rows are only as wide as the fullest row.
+
+    Args:
+        max_tokens:     Token budget per packed row; longer samples are truncated.
+        pad_token_id:   Filler id for the unused tail of a row.
+        mask_format:    ``"4d"`` returns a block-diagonal causal additive mask of
+                        shape (rows, 1, L, L) for eager/SDPA attention;
+                        ``"flash"`` omits the mask and relies on the reset
+                        ``position_ids`` (FlashAttention-2 varlen detection).
+        return_sample_index: Also return ``sample_index`` (rows, L): the input
+                        position of the sample owning each token, -1 on padding.
+                        Not a model argument, so leave it off for ``Trainer``.
+    """
+
+    def __init__(self, max_tokens: int, pad_token_id: int = 0, mask_format: str = "4d",
+                 return_sample_index: bool = False, dtype: torch.dtype = torch.float32) -> None:
+        if mask_format not in ("4d", "flash"):
+            raise ValueError(f"Unknown mask_format: {mask_format!r}")
+        self.max_tokens = max_tokens
+        self.pad_token_id = pad_token_id
+        self.mask_format = mask_format
+        self.return_sample_index = return_sample_index
+        self.dtype = dtype
+
+    def _samples(self, features: Sequence[Dict[str, Any]]):
+        for feature in features:
+            ids = _as_list(feature["input_ids"])
+            labels = _as_list(feature.get("labels", ids))
+            if "attention_mask" in feature:
+                keep = [i for i, m in enumerate(_as_list(feature["attention_mask"])) if m]
+                ids, labels = [ids[i] for i in keep], [labels[i] for i in keep]
+            yield ids[:self.max_tokens], labels[:self.max_tokens]
+
+    def __call__(self, features: Sequence[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        samples = list(self._samples(features))
+
+        rows: List[List[int]] = []          # sample indices per row
+        free: List[int] = []                # remaining budget per row
+        for i in sorted(range(len(samples)), key=lambda i: -len(samples[i][0])):
+            n = len(samples[i][0])
+            row = next((r for r, f in enumerate(free) if f >= n), None)
+            if row is None:
+                rows.append([])
+                free.append(self.max_tokens)
+                row = len(rows) - 1
+            rows[row].append(i)
+            free[row] -= n
+
+        width = max((self.max_tokens - f for f in free), default=0)
+        input_ids = torch.full((len(rows), width), self.pad_token_id, dtype=torch.long)
+        labels = torch.full((len(rows), width), IGNORE_INDEX, dtype=torch.long)
+        position_ids = torch.zeros((len(rows), width), dtype=torch.long)
+        sample_index = torch.full((len(rows), width), -1, dtype=torch.long)
+        for r, members in enumerate(rows):
+            col = 0
+            for i in members:
+                ids, lab = samples[i]
+                n = len(ids)
+                input_ids[r, col:col + n] = torch.tensor(ids, dtype=torch.long)
+                labels[r, col:col + n] = torch.tensor(lab, dtype=torch.long)
+                labels[r, col] = IGNORE_INDEX   # never predict a sample's first token from its neighbour
+                position_ids[r, col:col + n] = torch.arange(n)
+                sample_index[r, col:col + n] = i
+                col += n
+
+        batch = {"input_ids": input_ids, "labels": labels, "position_ids": position_ids}
+        if self.mask_format == "4d":
+            batch["attention_mask"] = block_causal_mask(sample_index, self.dtype)
+        if self.return_sample_index:
+            batch["sample_index"] = sample_index
+        return batch
+
+
+def block_causal_mask(sample_index: torch.Tensor, dtype: torch.dtype = torch.float32) -> torch.Tensor:
+    """Additive (rows, 1, L, L) mask: attend only to earlier tokens of the same sample."""
+    L = sample_index.shape[1]
+    same = sample_index[:, :, None] == sample_index[:, None, :]
+    causal = torch.ones(L, L, dtype=torch.bool, device=sample_index.device).tril()
+    allowed = same & causal & (sample_index[:, :, None] >= 0)
+    allowed |= torch.eye(L, dtype=torch.bool, device=sample_index.device)   # keep pad rows finite
+    mask = torch.zeros(allowed.shape, dtype=dtype, device=sample_index.device)
+    return mask.masked_fill_(~allowed, torch.finfo(dtype).min)[:, None]
+
+
+def packed_token_logps(logits: torch.Tensor, input_ids: torch.Tensor, labels: torch.Tensor,
+                       temperature: float = 1.0) -> torch.Tensor:
+    """Per-token log-probs (rows, L) of packed inputs; 0 where the label is ignored.
+
+    Position ``t`` holds ``log p(input_ids[t] | tokens < t of the same sample)``.
+    """
+    logp = torch.zeros(input_ids.shape, dtype=torch.float32, device=input_ids.device)
+    scaled = logits[:, :-1].float() / temperature
+    lp = torch.gather(scaled, -1, input_ids[:, 1:].unsqueeze(-1)).squeeze(-1) - torch.logsumexp(scaled, -1)
+    logp[:, 1:] = torch.where(labels[:, 1:] != IGNORE_INDEX, lp, 0.0)
+    return logp
+
+
+def per_sample_sum(values: torch.Tensor, sample_index: torch.Tensor, num_samples: int) -> torch.Tensor:
+    """Sum packed per-token *values* back into one value per original sample."""
+    keep = sample_index >= 0
+    out = torch.zeros(num_samples, dtype=values.dtype, device=values.device)
+    return out.index_add(0, sample_index[keep], values[keep])
+
+
+def per_sample_mean(values: torch.Tensor, sample_index: torch.Tensor, labels: torch.Tensor,
+                    num_samples: int) -> torch.Tensor:
+    """Mean of *values* over each sample's supervised tokens (e.g. per-sample loss)."""
+    counted = (labels != IGNORE_INDEX).to(values.dtype)
+    total = per_sample_sum(values * counted, sample_index, num_samples)
+    count = per_sample_sum(counted, sample_index, num_samples)
+    return total / count.clamp_min(1)
+
+
+# -----------------------------------------------------------------------------
+# Model preparation
+# -----------------------------------------------------------------------------
+def packed_sdpa_attention(module: torch.nn.Module, query: torch.Tensor, key: torch.Tensor, value: torch.Tensor,
+                          attention_mask: Optional[torch.Tensor], **kwargs):
+    """SDPA that uses the block mask stashed on *module* by the packing hook, if any."""
+    mask = getattr(module, "_packed_mask", None)
+    if mask is None:
+        return sdpa_attention_forward(module, query, key, value, attention_mask, **kwargs)
+    kwargs["is_causal"] = False
+    return sdpa_attention_forward(module, query, key, value, mask.to(query.dtype), **kwargs)
+
+
+AttentionInterface.register(PACKED_ATTENTION, packed_sdpa_attention)
+
+
+def prepare_model_for_packing(model: torch.nn.Module, mask_format: str = "4d") -> torch.nn.Module:
+    """Make *model* respect the sample boundaries of :class:`PackedCollator` batches.
+
+    ``"flash"`` requires FlashAttention-2 (eager/SDPA would let samples attend
+    across boundaries). For ``"4d"``, models that take 4D masks natively (e.g.
+    Llama, Qwen2) are returned unchanged; for :data:`FLAT_MASK_MODELS` a
+    forward pre-hook on the base model takes the 4D mask out of the call and
+    hands it to every attention module, which then run
+    :func:`packed_sdpa_attention`.
+    """
+    config = model.config
+    if mask_format == "flash":
+        if config._attn_implementation != "flash_attention_2":
+            raise ValueError(f"mask_format='flash' needs attn_implementation='flash_attention_2', "
+                             f"got {config._attn_implementation!r}; use mask_format='4d'")
+        return model
+    if mask_format != "4d":
+        raise ValueError(f"Unknown mask_format: {mask_format!r}")
+    if config.model_type not in FLAT_MASK_MODELS:
+        return model
+
+    base = model.base_model
+    attention = [m for m in base.modules() if hasattr(m, "is_cross_attention") and not m.is_cross_attention]
+
+    def stash_mask(module, args, kwargs):
+        mask = kwargs.get("attention_mask")
+        packed = mask if mask is not None and mask.dim() == 4 else None
+        for m in attention:
+            m._packed_mask = packed     # kept until the next call, so checkpointed recomputes still see it
+        if packed is not None:
+            kwargs["attention_mask"] = None
+        return args, kwargs
+
+    base.register_forward_pre_hook(stash_mask, with_kwargs=True)
+    config._attn_implementation = PACKED_ATTENTION
+    return model
@@ -0,0 +1,54 @@
+'''
+GRPO Reference Log-Probs
+Description: Reference-policy log-probs for the KL term of GRPO without keeping
+a deep copy of the policy. Two modes:
+    "adapter": score with the policy's frozen base (PEFT adapters disabled) on
+               every call
+    "cached":  score once per rollout batch, right after generation, and reuse
+               it; an optional separate frozen ``ref_model`` (e.g. memory-mapped
+               through model_registry) replaces the disabled-adapter base
+Any causal LM works, so both modes run on CPU with a tiny PEFT model.
+'''
+
+from __future__ import annotations
+
+from typing import Any, Callable, Dict, Optional
+
+import torch
+
+
+class ReferenceLogProbs:
+    """Reference-policy log-probs for a rollout without duplicating the policy.
+
+    Args:
+        policy:    The trained model; must be a PEFT model unless ``ref_model`` is given.
+        score_fn:  ``score_fn(rollout, model=...)`` returning the summed log-probs
+                   (e.g. ``GRPOTrainer.sequence_logps``).
+        mode:      ``"adapter"`` or ``"cached"``.
+        ref_model: Optional separate frozen reference model.
+    """
+
+    def __init__(self, policy: torch.nn.Module, score_fn: Callable[..., torch.Tensor], mode: str = "adapter",
+                 ref_model: Optional[torch.nn.Module] = None) -> None:
+        if mode not in ("adapter", "cached"):
+            raise ValueError(f"Unknown reference mode: {mode!r}")
+        if ref_model is None and not hasattr(policy, "disable_adapter"):
+            raise ValueError("Without a ref_model the policy must be a PEFT model (adapters to disable)")
+        self.policy, self.score_fn, self.mode, self.ref_model = policy, score_fn, mode, ref_model
+
+    @torch.no_grad()
+    def _score(self, rollout: Dict[str, Any]) -> torch.Tensor:
+        if self.ref_model is not None:
+            return self.score_fn(rollout, model=self.ref_model)
+        with self.policy.disable_adapter():
+            return self.score_fn(rollout, model=self.policy)
+
+    def precompute(self, rollout: Dict[str, Any]) -> None:
+        """Cache reference log-probs on the rollout (no-op in "adapter" mode)."""
+        if self.mode == "cached" and "ref_logps" not in rollout:
+            rollout["ref_logps"] = self._score(rollout)
+
+    def __call__(self, rollout: Dict[str, Any]) -> torch.Tensor:
+        if "ref_logps" in rollout:
+            return rollout["ref_logps"]
+        return self._score(rollout)
@@ -0,0 +1,241 @@
+'''
+Speculative Decoding
+Description: A small draft model proposes k tokens, the target model scores all
+of them in a single forward pass, and standard rejection sampling keeps the
+output distribution identical to sampling from the target alone (greedy
+decoding stays token-for-token identical). Reports acceptance rate and speedup.
+
+Both models must share a tokenizer (e.g. the Tiny-GPT-ish-LM.yaml checkpoints
+under LLM-from-Scratch; see check_tokenizers_match). The draft's output layer
+may be larger than the target's (padded vocabularies): its proposals are then
+restricted to the target's ids, while the target's logits are never truncated.
+'''
+
+from __future__ import annotations
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
+
+import torch
+
+# -----------------------------------------------------------------------------
+# Logging configuration
+# -----------------------------------------------------------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Bookkeeping
+# -----------------------------------------------------------------------------
+@dataclass
+class SpeculativeStats:
+    """Counters of one speculative generation."""
+
+    proposed: int = 0
+    accepted: int = 0
+    generated: int = 0
+    target_calls: int = 0
+    draft_calls: int = 0
+    seconds: float = 0.0
+    baseline_seconds: Optional[float] = None
+
+    @property
+    def acceptance_rate(self) -> float:
+        return self.accepted / self.proposed if self.proposed else 0.0
+
+    @property
+    def tokens_per_target_call(self) -> float:
+        return self.generated / self.target_calls if self.target_calls else 0.0
+
+    @property
+    def speedup(self) -> Optional[float]:
+        if self.baseline_seconds is None or not self.seconds:
+            return None
+        return self.baseline_seconds / self.seconds
+
+
+class _CachedLM:
+    """A causal LM plus its KV cache, which can be rolled back after rejections."""
+
+    def __init__(self, model: Any) -> None:
+        self.model = model
+        self.cache = None
+        self.cached_len = 0
+        self.calls = 0
+
+    def logits(self, ids: torch.Tensor) -> Tuple[torch.Tensor, int]:
+        """Logits for positions ``start .. len(ids)-1``; returns them and ``start``."""
+        if self.cached_len >= ids.shape[1]:
+            self.rollback(ids.shape[1] - 1)
+        start = self.cached_len
+        out = self.model(input_ids=ids[:, start:], past_key_values=self.cache, use_cache=True)
+        self.cache = out.past_key_values
+        self.cached_len = ids.shape[1]
+        self.calls += 1
+        return out.logits.float(), start
+
+    def rollback(self, length: int) -> None:
+        if length >= self.cached_len:
+            return
+        if hasattr(self.cache, "crop"):
+            self.cache.crop(length)
+            self.cached_len = length
+        else:  # legacy tuple caches cannot be cropped: recompute from scratch
+            self.cache, self.cached_len = None, 0
+
+
+def _probs(logits: torch.Tensor, temperature: float) -> torch.Tensor:
+    if temperature == 0:
+        return torch.nn.functional.one_hot(logits.argmax(-1), logits.shape[-1]).float()
+    return torch.softmax(logits / temperature, dim=-1)
+
+
+def check_tokenizers_match(target_tokenizer: Any, draft_tokenizer: Any) -> None:
+    """Raise unless both tokenizers map the same strings to the same ids."""
+    if target_tokenizer.get_vocab() != draft_tokenizer.get_vocab():
+        raise ValueError(f"Draft tokenizer {draft_tokenizer.name_or_path!r} differs from target tokenizer "
+                         f"{target_tokenizer.name_or_path!r}: draft token ids would mean nothing to the target")
+
+
+def _sample(probs: torch.Tensor, generator: Optional[torch.Generator]) -> torch.Tensor:
+    return torch.multinomial(probs, 1, generator=generator)
+
+# -----------------------------------------------------------------------------
+# Decoding
+# -----------------------------------------------------------------------------
+@torch.no_grad()
+def speculative_generate(
+    target: Any,
+    draft: Any,
+    input_ids: torch.Tensor,
+    max_new_tokens: int,
+    num_draft_tokens: int = 4,
+    temperature: float = 0.0,
+    eos_token_id: Optional[int] = None,
+    stopping_criteria: Any = None,
+    generator: Optional[torch.Generator] = None,
+    measure_baseline: bool = False,
+) -> Tuple[torch.Tensor, SpeculativeStats]:
+    """Speculatively decode up to *max_new_tokens* for a single sequence.
+
+    ``temperature=0`` is greedy: a draft token is kept iff it is the target's
+    argmax. Otherwise draft token x with draft prob q(x) is kept with
+    probability min(1, p(x)/q(x)); on the first rejection a replacement is
+    drawn from normalize(max(0, p - q)), and if all k are kept a bonus token is
+    drawn from p. ``stopping_criteria`` (e.g. StopOnNumberedSteps) is checked
+    after every verified chunk.
+    """
+    if input_ids.shape[0] != 1:
+        raise ValueError("speculative_generate decodes one sequence at a time")
+    vocab = target.get_output_embeddings().weight.shape[0]
+    draft_vocab = draft.get_output_embeddings().weight.shape[0]
+    if draft_vocab < vocab:
+        raise ValueError(f"Draft vocabulary ({draft_vocab}) is smaller than the target's ({vocab}); "
+                         "the draft cannot read the target's tokens")
+    tgt, drf = _CachedLM(target), _CachedLM(draft)
+    stats = SpeculativeStats()
+    ids = input_ids
+    prompt_len = input_ids.shape[1]
+    t0 = time.perf_counter()
+
+    while ids.shape[1] - prompt_len < max_new_tokens:
+        L = ids.shape[1]
+        k = min(num_draft_tokens, max_new_tokens - (L - prompt_len) - 1)
+
+        # 1) draft proposes k tokens autoregressively
+        proposal, q = ids, []
+        for _ in range(k):
+            logits, _ = drf.logits(proposal)
+            # any proposal distribution over the target's ids keeps the output exact
+            q.append(_probs(logits[0, -1, :vocab], temperature))
+            proposal = torch.cat([proposal, _sample(q[-1], generator)[None]], dim=1)
+
+        # 2) target scores the prompt tail and all k proposals in one pass
+        tgt.rollback(L - 1)
+        logits, start = tgt.logits(proposal)
+        p = _probs(logits[0, L - 1 - start:], temperature)        # (k + 1, V)
+
+        # 3) accept / reject
+        n_acc = 0
+        for i in range(k):
+            x = proposal[0, L + i]
+            if temperature == 0:
+                keep = bool(p[i].argmax() == x)
+            else:
+                u = torch.rand((), generator=generator, device=p.device)
+                keep = bool(u < torch.clamp(p[i, x] / q[i][x], max=1.0))
+            if not keep:
+                break
+            n_acc += 1
+        if n_acc < k:
+            residual = torch.clamp(p[n_acc] - q[n_acc], min=0)
+            residual = residual / residual.sum() if residual.sum() > 0 else p[n_acc]
+            nxt = _sample(residual, generator)
+        else:
+            nxt = _sample(p[k], generator)
+
+        ids = torch.cat([proposal[:, :L + n_acc], nxt[None]], dim=1)
+        tgt.rollback(L + n_acc)
+        drf.rollback(L + n_acc)
+        stats.proposed += k
+        stats.accepted += n_acc
+
+        new = ids[0, L:]
+        if eos_token_id is not None and (new == eos_token_id).any():
+            cut = int((new == eos_token_id).nonzero()[0]) + 1
+            ids = ids[:, :L + cut]
+            break
+        if stopping_criteria is not None and bool(torch.as_tensor(stopping_criteria(ids, None)).all()):
+            break
+
+    stats.seconds = time.perf_counter() - t0
+    stats.generated = ids.shape[1] - prompt_len
+    stats.target_calls, stats.draft_calls = tgt.calls, drf.calls
+    if measure_baseline:
+        _, stats.baseline_seconds = autoregressive_generate(target, input_ids, stats.generated,
+                                                            temperature, generator=generator)
+    logger.info("Speculative decoding: %d tokens, acceptance %.2f, %.2f tokens/target call, speedup %s",
+                stats.generated, stats.acceptance_rate, stats.tokens_per_target_call,
+                f"{stats.speedup:.2f}x" if stats.speedup else "n/a")
+    return ids, stats
+
+
+@torch.no_grad()
+def autoregressive_generate(model: Any, input_ids: torch.Tensor, max_new_tokens: int,
+                            temperature: float = 0.0,
+                            generator: Optional[torch.Generator] = None) -> Tuple[torch.Tensor, float]:
+    """Plain one-token-per-forward decoding with the same KV-cache machinery (the baseline)."""
+    lm = _CachedLM(model)
+    ids = input_ids
+    t0 = time.perf_counter()
+    for _ in range(max_new_tokens):
+        logits, _ = lm.logits(ids)
+        ids = torch.cat([ids, _sample(_probs(logits[0, -1], temperature), generator)[None]], dim=1)
+    return ids, time.perf_counter() - t0
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from model_registry import get_model
+
+    parser = argparse.ArgumentParser(description="Speculative decoding between two local checkpoints.")
+    parser.add_argument("target", help="e.g. LLM-from-Scratch/checkpoint-99")
+    parser.add_argument("draft", help="e.g. LLM-from-Scratch/checkpoint-12")
+    parser.add_argument("--prompt", default="<bos>")
+    parser.add_argument("-k", "--num-draft-tokens", type=int, default=4)
+    parser.add_argument("--max-new-tokens", type=int, default=12)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    args = parser.parse_args()
+
+    target, draft = get_model(args.target), get_model(args.draft)
+    check_tokenizers_match(target.tokenizer, draft.tokenizer)
+    input_ids = target.tokenizer(args.prompt, return_tensors="pt")["input_ids"]
+    out, stats = speculative_generate(target.model, draft.model, input_ids, args.max_new_tokens,
+                                      args.num_draft_tokens, args.temperature,
+                                      generator=torch.Generator().manual_seed(0), measure_baseline=True)
+    print(target.tokenizer.decode(out[0]))
+    print(f"acceptance rate {stats.acceptance_rate:.2f}, {stats.tokens_per_target_call:.2f} tokens/target call, "
+          f"speedup {stats.speedup:.2f}x")
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from checkpointing import CheckpointManager
+
+
+def tiny_gpt2():
+    torch.manual_seed(0)
+    return GPT2LMHeadModel(GPT2Config(vocab_size=32, n_positions=16, n_embd=8, n_layer=1, n_head=2))
+
+
+def test_checkpoint_is_a_pretrained_directory(tmp_path):
+    model = tiny_gpt2()
+    manager = CheckpointManager(str(tmp_path), async_write=False)
+    manager.save(1, model)
+    loaded = GPT2LMHeadModel.from_pretrained(tmp_path / "checkpoint-1")
+    for name, t in model.state_dict().items():
+        torch.testing.assert_close(loaded.state_dict()[name], t)
+
+
+def test_in_place_edit_through_data_is_saved(tmp_path):
+    model = tiny_gpt2()
+    manager = CheckpointManager(str(tmp_path), async_write=False)
+    manager.save(1, model)
+    model.transformer.wpe.weight.data.mul_(2)
+    manager.save(2, model)
+
+    restored = tiny_gpt2()
+    restored.transformer.wpe.weight.data.zero_()
+    manager.load(restored, which=str(tmp_path / "checkpoint-2"))
+    torch.testing.assert_close(restored.transformer.wpe.weight, model.transformer.wpe.weight)
+
+
+def test_unchanged_tensors_are_deduplicated(tmp_path):
+    model = tiny_gpt2()
+    manager = CheckpointManager(str(tmp_path), async_write=False)
+    manager.save(1, model)
+    blobs = len(os.listdir(tmp_path / "blobs"))
+    model.transformer.wpe.weight.data.add_(1)
+    manager.save(2, model)
+    assert len(os.listdir(tmp_path / "blobs")) == blobs + 1
+
+
+def test_load_latest_from_empty_root(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        CheckpointManager(str(tmp_path), async_write=False).load(tiny_gpt2())
+
+
+def test_partial_writes_are_removed(tmp_path):
+    (tmp_path / ".checkpoint-7.tmp").mkdir()
+    (tmp_path / "blobs").mkdir()
+    (tmp_path / "blobs" / "abc.safetensors.tmp").write_bytes(b"")
+    CheckpointManager(str(tmp_path), async_write=False)
+    assert not (tmp_path / ".checkpoint-7.tmp").exists()
+    assert os.listdir(tmp_path / "blobs") == []
+
+
+def test_callback_attaches_only_the_metric_measured_at_the_saved_step(tmp_path):
+    from transformers import Trainer, TrainingArguments
+
+    from checkpointing import AsyncCheckpointCallback
+
+    data = [{"input_ids": torch.arange(8) % 32, "labels": torch.arange(8) % 32}] * 4
+    manager = CheckpointManager(str(tmp_path / "ckpt"), keep_last=10, async_write=False)
+    args = TrainingArguments(output_dir=str(tmp_path / "out"), max_steps=6, per_device_train_batch_size=2,
+                             eval_strategy="steps", eval_steps=4, save_strategy="no",
+                             report_to=[], use_cpu=True, learning_rate=1e-2)
+    trainer = Trainer(model=tiny_gpt2(), args=args, train_dataset=data, eval_dataset=data,
+                      callbacks=[AsyncCheckpointCallback(manager, save_steps=2)])
+    trainer.train()
+
+    evals = {e["step"]: e["eval_loss"] for e in trainer.state.log_history if "eval_loss" in e}
+    assert list(evals) == [4]
+    assert {m["step"]: m["metric"] for m in manager.checkpoints()} == {2: None, 4: evals[4], 6: None}
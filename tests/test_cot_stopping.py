@@ -0,0 +1,107 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+import torch
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location("falcon_cot", os.path.join(ROOT, "Falcon-Guided-CoT-Integration.py"))
+falcon_cot = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = falcon_cot
+spec.loader.exec_module(falcon_cot)
+StopOnNumberedSteps = falcon_cot.StopOnNumberedSteps
+
+PIECES = ["<p>", "a", " b", "\n", "\n\n", "c\nd", "  ", "e\n"]
+P, A, B, NL, NLNL, C_NL_D, SPACE, E_NL = range(len(PIECES))
+
+
+class PieceTokenizer:
+    def __len__(self):
+        return len(PIECES)
+
+    def batch_decode(self, ids):
+        return ["".join(PIECES[i] for i in row) for row in ids]
+
+
+TOKENIZER = PieceTokenizer()
+
+
+def run(criteria, rows, prompt_len=1):
+    """Feed *rows* one generated column at a time; return the per-row result of every call."""
+    ids = torch.tensor(rows)
+    return [criteria(ids[:, :t], None).tolist() for t in range(prompt_len + 1, ids.shape[1] + 1)]
+
+
+def test_rows_are_counted_independently():
+    criteria = StopOnNumberedSteps(TOKENIZER, max_steps=2)
+    results = run(criteria, [[P, A, NL, B, NL, A],
+                             [P, A, NL, A, A, A]])
+    assert results[-1] == [True, False]
+    assert results[3] == [True, False]          # row 0 stops at its second completed line
+
+
+def test_blank_lines_do_not_count():
+    criteria = StopOnNumberedSteps(TOKENIZER, max_steps=2)
+    results = run(criteria, [[P, NL, NLNL, SPACE, NL, A, NL, NL, B, NL]])
+    assert [r[0] for r in results] == [False] * 8 + [True]
+
+
+def test_tokens_with_several_newlines():
+    criteria = StopOnNumberedSteps(TOKENIZER, max_steps=2)
+    # "a" + "c\nd" completes one line and starts another with text; "e\n" completes it
+    results = run(criteria, [[P, A, C_NL_D, E_NL]])
+    assert [r[0] for r in results] == [False, False, True]
+
+
+def test_reuse_after_reset_with_a_longer_prompt():
+    criteria = StopOnNumberedSteps(TOKENIZER, max_steps=1)
+    assert run(criteria, [[P, A, NL]])[-1] == [True]
+    criteria.reset()
+    # the previous run's newline must not leak into a new, longer sequence
+    assert run(criteria, [[P, NL, P, A, A, NL]], prompt_len=4) == [[False], [True]]
+
+
+def test_reuse_without_reset_is_detected_when_possible():
+    criteria = StopOnNumberedSteps(TOKENIZER, max_steps=1)
+    run(criteria, [[P, A, A, A]])
+    with pytest.raises(RuntimeError, match="reset"):
+        criteria(torch.tensor([[P, A]]), None)
+    with pytest.raises(RuntimeError, match="reset"):
+        criteria(torch.tensor([[P, A, A, A, A], [P, A, A, A, A]]), None)
+
+
+class CharTokenizer:
+    pad_token_id = 0
+    eos_token_id = None
+
+    def __len__(self):
+        return 128
+
+    def __call__(self, text):
+        return {"input_ids": [ord(c) if ord(c) < 128 else ord("?") for c in text]}
+
+    def batch_decode(self, ids, skip_special_tokens=False):
+        return ["".join(chr(i) for i in row) for row in ids]
+
+
+def test_outlines_do_not_depend_on_bucketing(monkeypatch):
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    monkeypatch.setattr(falcon_cot, "format_cot_outline", lambda gen, n_steps: gen)
+    tokenizer = CharTokenizer()
+    questions = ["", "ab", "abcd", "abcdef", "abcdefgh", "x" * 40]
+    base = len(tokenizer(falcon_cot.build_cot_prompt(""))["input_ids"])
+    torch.manual_seed(0)
+    # the window fits the shorter prompts with the full budget and caps the rest
+    model = GPT2LMHeadModel(GPT2Config(vocab_size=128, n_positions=base + 9,
+                                       n_embd=32, n_layer=2, n_head=2)).eval()
+
+    def outlines(batch_size):
+        return dict(falcon_cot.generate_cot_outlines(questions, max_new_tokens=6, batch_size=batch_size,
+                                                     model=model, tokenizer=tokenizer))
+
+    single = outlines(1)
+    assert [len(single[i]) for i in range(len(questions))] == [6, 6, 5, 3, 1, 1]
+    assert outlines(len(questions)) == single
+    assert outlines(4) == single
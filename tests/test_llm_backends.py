@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_backends import MockBackend  # noqa: E402
+
+N = 8
+
+
+def concurrently(fn, n=N):
+    """Call *fn* from *n* threads released at the same time; return results or exceptions."""
+    barrier = threading.Barrier(n)
+
+    def call(_):
+        barrier.wait()
+        try:
+            return fn()
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(n) as pool:
+        return list(pool.map(call, range(n)))
+
+
+def test_identical_concurrent_prompts_make_one_call():
+    calls = []
+    backend = MockBackend(responder=lambda p: calls.append(p) or p.upper(), latency=0.5)
+    results = concurrently(lambda: backend.complete("hello"))
+    assert results == ["HELLO"] * N
+    assert calls == ["hello"]
+    assert backend.stats == {"requests": N, "calls": 1, "coalesced": N - 1}
+    backend.close()
+
+
+def test_exception_reaches_every_waiter():
+    def fail(prompt):
+        raise RuntimeError("provider down")
+
+    backend = MockBackend(responder=fail, latency=0.5)
+    results = concurrently(lambda: backend.complete("hello"))
+    assert all(isinstance(r, RuntimeError) and str(r) == "provider down" for r in results)
+    assert backend.stats["calls"] == 1
+    assert backend._inflight == {}
+    backend.close()
+
+
+def test_inflight_entry_is_cleared_after_the_call():
+    backend = MockBackend(latency=0.05)
+    assert backend.complete("hello") == backend.complete("hello")
+    assert backend._inflight == {}
+    assert backend.stats == {"requests": 2, "calls": 2, "coalesced": 0}
+    backend.close()
+
+
+def test_acomplete_and_astream():
+    backend = MockBackend(responder=lambda p: "one two three", latency=0.2)
+
+    async def main():
+        completions = await asyncio.gather(*(backend.acomplete("hello") for _ in range(4)))
+        chunks = [chunk async for chunk in backend.astream("hello")]
+        return completions, chunks
+
+    completions, chunks = asyncio.run(main())
+    assert completions == ["one two three"] * 4
+    assert backend.stats["calls"] == 2        # one coalesced completion, one stream
+    assert chunks == ["one ", "two ", "three"]
+    backend.close()
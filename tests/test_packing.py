@@ -0,0 +1,56 @@
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel, LlamaConfig, LlamaForCausalLM
+
+from packing import (PackedCollator, packed_token_logps, per_sample_sum,
+                     prepare_model_for_packing)
+
+VOCAB = 64
+
+
+def tiny_gpt2():
+    return GPT2LMHeadModel(GPT2Config(vocab_size=VOCAB, n_positions=32, n_embd=16, n_layer=2, n_head=2))
+
+
+def tiny_llama():
+    return LlamaForCausalLM(LlamaConfig(vocab_size=VOCAB, hidden_size=16, intermediate_size=32,
+                                        num_hidden_layers=2, num_attention_heads=2, num_key_value_heads=1,
+                                        max_position_embeddings=32))
+
+
+def unpacked_logps(model, samples):
+    out = []
+    for ids in samples:
+        ids = torch.tensor([ids])
+        logp = torch.log_softmax(model(input_ids=ids).logits[0, :-1].float(), -1)
+        out.append(logp.gather(-1, ids[0, 1:, None]).sum())
+    return torch.stack(out)
+
+
+@pytest.mark.parametrize("build", [tiny_gpt2, tiny_llama])
+def test_packed_logps_match_unpacked(build):
+    torch.manual_seed(0)
+    model = prepare_model_for_packing(build().eval())
+    samples = [torch.randint(0, VOCAB, (n,)).tolist() for n in (7, 3, 12, 5, 9, 2)]
+    batch = PackedCollator(max_tokens=16, return_sample_index=True)([{"input_ids": s} for s in samples])
+    assert batch["input_ids"].shape[0] < len(samples)     # samples really share rows
+
+    sample_index = batch.pop("sample_index")
+    labels = batch.pop("labels")
+    with torch.no_grad():
+        logits = model(**batch).logits
+        packed = per_sample_sum(packed_token_logps(logits, batch["input_ids"], labels),
+                                sample_index, len(samples))
+        expected = unpacked_logps(model, samples)
+    torch.testing.assert_close(packed, expected, atol=1e-5, rtol=1e-5)
+
+
+def test_packed_training_loss_runs_on_gpt2():
+    model = prepare_model_for_packing(tiny_gpt2())
+    batch = PackedCollator(max_tokens=16)([{"input_ids": list(range(1, n))} for n in (6, 9, 4)])
+    model(**batch).loss.backward()
+
+
+def test_flash_format_requires_flash_attention():
+    with pytest.raises(ValueError, match="flash_attention_2"):
+        prepare_model_for_packing(tiny_gpt2(), mask_format="flash")
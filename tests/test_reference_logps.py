@@ -0,0 +1,49 @@
+import torch
+from peft import LoraConfig, get_peft_model
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from reference_logps import ReferenceLogProbs
+
+
+def sequence_logps(rollout, model):
+    ids = rollout["input_ids"]
+    logp = torch.log_softmax(model(input_ids=ids).logits[:, :-1].float(), -1)
+    return logp.gather(-1, ids[:, 1:, None]).squeeze(-1).sum(1)
+
+
+def tiny_peft_policy():
+    torch.manual_seed(0)
+    base = GPT2LMHeadModel(GPT2Config(vocab_size=32, n_positions=16, n_embd=16, n_layer=1, n_head=2)).eval()
+    rollout = {"input_ids": torch.randint(0, 32, (3, 8))}
+    with torch.no_grad():
+        base_logps = sequence_logps(rollout, base)
+    # random (non-zero) adapter weights so the adapter really changes the policy
+    policy = get_peft_model(base, LoraConfig(r=4, target_modules=["c_attn"], init_lora_weights=False))
+    return policy, rollout, base_logps
+
+
+def test_adapter_mode_scores_the_base_model():
+    policy, rollout, base_logps = tiny_peft_policy()
+    ref = ReferenceLogProbs(policy, sequence_logps, mode="adapter")
+    with torch.no_grad():
+        assert not torch.allclose(sequence_logps(rollout, policy), base_logps)
+    torch.testing.assert_close(ref(rollout), base_logps)
+
+
+def test_cached_mode_reuses_stored_values():
+    policy, rollout, base_logps = tiny_peft_policy()
+    calls = []
+
+    def counting_score(rollout, model):
+        calls.append(1)
+        return sequence_logps(rollout, model)
+
+    ref = ReferenceLogProbs(policy, counting_score, mode="cached")
+    ref.precompute(rollout)
+    ref.precompute(rollout)
+    with torch.no_grad():
+        for p in policy.get_base_model().parameters():
+            p.add_(1.0)                                   # later updates must not leak in
+    torch.testing.assert_close(ref(rollout), base_logps)
+    torch.testing.assert_close(ref(rollout), base_logps)
+    assert len(calls) == 1
@@ -0,0 +1,67 @@
+import importlib.util
+import os
+import random
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location("sequential_evaluation",
+                                              os.path.join(ROOT, "Sequential-Evaluation.py"))
+sequential_evaluation = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = sequential_evaluation
+spec.loader.exec_module(sequential_evaluation)
+SequentialEvaluator = sequential_evaluation.SequentialEvaluator
+
+
+def false_stop_rate(runs, horizon, **kwargs):
+    """Fraction of runs with identically distributed conditions that stop as 'significant'."""
+    rng = random.Random(1)
+    false_stops = 0
+    for _ in range(runs):
+        evaluator = SequentialEvaluator(target_width=None, **kwargs)
+        for _ in range(horizon):
+            pair = []
+            for _ in range(2):
+                em = float(rng.random() < 0.4)
+                pair.append((em, max(em, rng.random() * 0.8)))
+            if evaluator.update(*pair):
+                break
+        false_stops += (evaluator.stop_reason or "").startswith("paired")
+    return false_stops / runs
+
+
+@pytest.mark.parametrize("max_examples", [200, None])
+def test_null_false_stop_rate_is_controlled(max_examples):
+    assert false_stop_rate(300, horizon=400, max_examples=max_examples) <= 0.05
+
+
+def test_per_look_level_spends_the_error_budget():
+    capped = SequentialEvaluator(min_examples=20, max_examples=200, check_every=5)
+    assert capped.look_confidence() == pytest.approx(1 - 0.05 / 36)
+
+    uncapped = SequentialEvaluator(min_examples=20, check_every=5)
+    alphas = [1 - uncapped.look_confidence(n) for n in range(20, 100_000, 5)]
+    assert sum(alphas) < 0.05
+
+
+def test_late_bootstrap_looks_have_bounded_cost(monkeypatch):
+    used = []
+    bootstrap = sequential_evaluation.bootstrap_interval
+
+    def counting(values, confidence, n_resamples, rng):
+        used.append(n_resamples)
+        return bootstrap(values, confidence, n_resamples, rng)
+
+    monkeypatch.setattr(sequential_evaluation, "bootstrap_interval", counting)
+    evaluator = SequentialEvaluator(method="bootstrap", target_width=None, check_every=1)
+    rng = random.Random(2)
+    for _ in range(2000):
+        em = float(rng.random() < 0.5)
+        evaluator.update((em, em), (em, em))
+
+    assert used and max(used) <= evaluator.max_resamples
+    start = time.perf_counter()
+    evaluator.difference("f1", confidence=evaluator.look_confidence(10**7))
+    assert time.perf_counter() - start < 0.5
@@ -0,0 +1,53 @@
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from speculative_decoding import autoregressive_generate, check_tokenizers_match, speculative_generate
+
+
+def tiny_gpt2(vocab, seed):
+    torch.manual_seed(seed)
+    return GPT2LMHeadModel(GPT2Config(vocab_size=vocab, n_positions=32, n_embd=16, n_layer=1, n_head=2)).eval()
+
+
+def test_greedy_matches_target_with_larger_draft_vocab():
+    target, draft = tiny_gpt2(40, 0), tiny_gpt2(64, 1)
+    prompt = torch.tensor([[1, 2, 3]])
+    expected, _ = autoregressive_generate(target, prompt, 12)
+    out, stats = speculative_generate(target, draft, prompt, 12, num_draft_tokens=3)
+    assert torch.equal(out, expected)
+    assert stats.proposed > 0
+
+
+def test_sampling_keeps_target_distribution():
+    target, draft = tiny_gpt2(6, 0), tiny_gpt2(9, 1)
+    prompt = torch.tensor([[1, 2]])
+    with torch.no_grad():
+        expected = torch.softmax(target(prompt).logits[0, -1], -1)
+    generator = torch.Generator().manual_seed(0)
+    counts = torch.zeros(6)
+    draws = 4000
+    for _ in range(draws):
+        out, _ = speculative_generate(target, draft, prompt, 2, num_draft_tokens=1,
+                                      temperature=1.0, generator=generator)
+        counts[out[0, 2]] += 1
+    torch.testing.assert_close(counts / draws, expected, atol=0.03, rtol=0)
+
+
+def test_smaller_draft_vocab_is_rejected():
+    with pytest.raises(ValueError, match="smaller"):
+        speculative_generate(tiny_gpt2(64, 0), tiny_gpt2(40, 1), torch.tensor([[1]]), 4)
+
+
+class _Tokenizer:
+    def __init__(self, name, vocab):
+        self.name_or_path, self._vocab = name, vocab
+
+    def get_vocab(self):
+        return self._vocab
+
+
+def test_mismatched_tokenizers_are_rejected():
+    check_tokenizers_match(_Tokenizer("a", {"x": 0}), _Tokenizer("b", {"x": 0}))
+    with pytest.raises(ValueError, match="differs"):
+        check_tokenizers_match(_Tokenizer("falcon", {"x": 0, "y": 1}), _Tokenizer("tiny", {"x": 0}))
@@ -0,0 +1,93 @@
+import json
+import os
+import random
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import token_shards  # noqa: E402
+from token_shards import TokenShardDataset, TokenShardStream, build_shards  # noqa: E402
+
+TOKENIZER = os.path.join(ROOT, "LLM-from-Scratch", "checkpoint-12", "tokenizer.json")
+BOS, EOS = 0, 1
+WORDS = {"apple": 3, "banana": 4}
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    rng = random.Random(0)
+    docs = [" ".join(rng.choice(list(WORDS)) for _ in range(rng.randint(1, 40))) for _ in range(23)]
+    out = str(tmp_path_factory.mktemp("shards"))
+    index = build_shards(iter(docs), TOKENIZER, out, docs_per_shard=5, num_proc=2, bos_token="<bos>")
+    expected = [[BOS] + [WORDS[w] for w in doc.split()] + [EOS] for doc in docs]
+    return os.path.join(out, "index.json"), index, expected
+
+
+def test_index_and_shard_files(corpus):
+    index_path, index, expected = corpus
+    with open(index_path) as f:
+        assert json.load(f) == index
+    assert [s["docs"] for s in index["shards"]] == [5, 5, 5, 5, 3]
+    assert index["total_docs"] == len(expected)
+    assert index["total_tokens"] == sum(map(len, expected))
+
+    root = os.path.dirname(index_path)
+    for k, shard in enumerate(index["shards"]):
+        docs = expected[5 * k:5 * k + 5]
+        ids = np.fromfile(os.path.join(root, shard["bin"]), dtype=index["dtype"])
+        offsets = np.fromfile(os.path.join(root, shard["idx"]), dtype=np.int64)
+        assert ids.tolist() == [t for doc in docs for t in doc]
+        assert offsets.tolist() == np.cumsum([0] + [len(d) for d in docs]).tolist()
+        assert shard["tokens"] == len(ids)
+
+
+def test_documents_mode_round_trips(corpus):
+    index_path, _, expected = corpus
+    ds = TokenShardDataset(index_path, mode="documents")
+    assert len(ds) == len(expected)
+    for i, doc in enumerate(expected):
+        assert ds[i]["input_ids"].tolist() == doc
+        assert ds[i]["labels"].tolist() == doc
+    with pytest.raises(IndexError):
+        ds[len(expected)]
+
+
+def shard_blocks(index, expected, block_size):
+    """Reference windows: per shard, non-overlapping, tail dropped."""
+    blocks = []
+    for k in range(len(index["shards"])):
+        flat = [t for doc in expected[5 * k:5 * k + 5] for t in doc]
+        blocks.append([flat[s:s + block_size] for s in range(0, len(flat) - block_size + 1, block_size)])
+    return blocks
+
+
+def test_blocks_mode_round_trips(corpus):
+    index_path, index, expected = corpus
+    ds = TokenShardDataset(index_path, block_size=7, mode="blocks")
+    reference = [b for shard in shard_blocks(index, expected, 7) for b in shard]
+    assert [ds[i]["input_ids"].tolist() for i in range(len(ds))] == reference
+
+
+def test_stream_splits_shards_across_workers(corpus, monkeypatch):
+    index_path, index, expected = corpus
+    per_shard = shard_blocks(index, expected, 7)
+    stream = TokenShardStream(index_path, block_size=7, shuffle=True, seed=3)
+
+    seen = []
+    for worker in range(2):
+        info = SimpleNamespace(id=worker, num_workers=2)
+        monkeypatch.setattr(token_shards, "get_worker_info", lambda: info)
+        seen.append([item["input_ids"].tolist() for item in stream])
+
+    # the shuffled shard order is dealt round-robin; each worker reads whole shards
+    order = list(range(len(per_shard)))
+    random.Random(3).shuffle(order)
+    for worker in range(2):
+        assert seen[worker] == [b for k in order[worker::2] for b in per_shard[k]]
+    everything = sorted(b for shard in per_shard for b in shard)
+    assert sorted(seen[0] + seen[1]) == everything
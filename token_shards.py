@@ -0,0 +1,257 @@
+'''
+Pre-Tokenized Token-ID Shards
+Description: Offline, multi-process tokenization of text corpora into fixed-dtype
+``.bin`` shards (plus per-shard document offsets and a JSON index), and
+memory-mapped random-access / streaming datasets that serve them to the trainer
+without ever materialising the corpus in RAM.
+
+Build:  python token_shards.py --tokenizer LLM-from-Scratch/tiny-tokenizer.json \\
+            --out shards/train corpus/*.txt
+'''
+
+from __future__ import annotations
+
+import argparse
+import bisect
+import json
+import logging
+import os
+import random
+from multiprocessing import Pool
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+
+# -----------------------------------------------------------------------------
+# Logging configuration
+# -----------------------------------------------------------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# Offline tokenization
+# -----------------------------------------------------------------------------
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(tokenizer_file: str, bos_id: Optional[int], eos_id: Optional[int], dtype: str) -> None:
+    from tokenizers import Tokenizer
+
+    tok = Tokenizer.from_file(tokenizer_file)
+    tok.no_padding()        # tokenizer.json may pad/truncate to the model window;
+    tok.no_truncation()     # shards must hold the raw documents
+    _worker.update(
+        tok=tok,
+        bos=[bos_id] if bos_id is not None else [],
+        eos=[eos_id] if eos_id is not None else [],
+        dtype=np.dtype(dtype),
+    )
+
+
+def _write_shard(task: Tuple[str, List[str]]) -> Dict[str, Any]:
+    """Tokenize one batch of documents and write ``<prefix>.bin`` / ``<prefix>.idx``."""
+    prefix, docs = task
+    tok, bos, eos, dtype = _worker["tok"], _worker["bos"], _worker["eos"], _worker["dtype"]
+    encodings = tok.encode_batch(docs, add_special_tokens=False)
+    lengths = np.fromiter((len(bos) + len(e.ids) + len(eos) for e in encodings),
+                          dtype=np.int64, count=len(encodings))
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    ids = np.empty(int(offsets[-1]), dtype=dtype)
+    for start, e in zip(offsets[:-1], encodings):
+        row = bos + e.ids + eos
+        ids[start:start + len(row)] = row
+    ids.tofile(prefix + ".bin")
+    offsets.tofile(prefix + ".idx")
+    return {"bin": os.path.basename(prefix) + ".bin", "idx": os.path.basename(prefix) + ".idx",
+            "tokens": int(offsets[-1]), "docs": len(docs)}
+
+
+def _read_documents(paths: Sequence[str]) -> Iterator[str]:
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.rstrip("\n")
+                if line.strip():
+                    yield line
+
+
+def build_shards(
+    documents: Iterable[str],
+    tokenizer_file: str,
+    out_dir: str,
+    docs_per_shard: int = 100_000,
+    num_proc: int = os.cpu_count() or 1,
+    bos_token: Optional[str] = None,
+    eos_token: Optional[str] = "<eos>",
+) -> Dict[str, Any]:
+    """Tokenize *documents* in parallel and write shards plus ``index.json``.
+
+    Documents are read lazily and handed to the pool a few shards at a time,
+    so memory is bounded by ``num_proc`` shards regardless of corpus size.
+    Token ids are stored as uint16 when the vocabulary fits, else uint32.
+    """
+    from tokenizers import Tokenizer
+
+    tok = Tokenizer.from_file(tokenizer_file)
+    vocab_size = tok.get_vocab_size()
+    dtype = "uint16" if vocab_size <= np.iinfo(np.uint16).max + 1 else "uint32"
+    special = {}
+    for role, token in (("bos", bos_token), ("eos", eos_token)):
+        special[role] = tok.token_to_id(token) if token else None
+        if token and special[role] is None:
+            raise ValueError(f"{role} token {token!r} is not in the vocabulary of {tokenizer_file}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    def tasks() -> Iterator[Tuple[str, List[str]]]:
+        batch: List[str] = []
+        shard_id = 0
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) == docs_per_shard:
+                yield os.path.join(out_dir, f"shard-{shard_id:05d}"), batch
+                batch, shard_id = [], shard_id + 1
+        if batch:
+            yield os.path.join(out_dir, f"shard-{shard_id:05d}"), batch
+
+    shards: List[Dict[str, Any]] = []
+    with Pool(num_proc, initializer=_init_worker,
+              initargs=(tokenizer_file, special["bos"], special["eos"], dtype)) as pool:
+        pending = []
+        for task in tasks():
+            pending.append(pool.apply_async(_write_shard, (task,)))
+            if len(pending) >= 2 * num_proc:     # back-pressure on the reader
+                shards.append(pending.pop(0).get())
+        shards.extend(p.get() for p in pending)
+
+    index = {
+        "dtype": dtype,
+        "vocab_size": vocab_size,
+        "bos_token_id": special["bos"],
+        "eos_token_id": special["eos"],
+        "total_tokens": sum(s["tokens"] for s in shards),
+        "total_docs": sum(s["docs"] for s in shards),
+        "shards": shards,
+    }
+    with open(os.path.join(out_dir, "index.json"), "w") as f:
+        json.dump(index, f, indent=2)
+    logger.info("Wrote %d shard(s), %d docs, %d tokens (%s) to %s",
+                len(shards), index["total_docs"], index["total_tokens"], dtype, out_dir)
+    return index
+
+# -----------------------------------------------------------------------------
+# Memory-mapped loaders
+# -----------------------------------------------------------------------------
+class _ShardReader:
+    """Opens shard memmaps lazily so datasets pickle cheaply into DataLoader workers."""
+
+    def __init__(self, index_path: str) -> None:
+        self.root = os.path.dirname(os.path.abspath(index_path))
+        with open(index_path) as f:
+            self.index = json.load(f)
+        self.dtype = np.dtype(self.index["dtype"])
+        self._maps: Dict[int, Tuple[np.memmap, np.memmap]] = {}
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {**self.__dict__, "_maps": {}}
+
+    @property
+    def shards(self) -> List[Dict[str, Any]]:
+        return self.index["shards"]
+
+    def open(self, i: int) -> Tuple[np.memmap, np.memmap]:
+        if i not in self._maps:
+            shard = self.shards[i]
+            ids = np.memmap(os.path.join(self.root, shard["bin"]), dtype=self.dtype, mode="r")
+            offsets = np.memmap(os.path.join(self.root, shard["idx"]), dtype=np.int64, mode="r")
+            self._maps[i] = (ids, offsets)
+        return self._maps[i]
+
+
+def _example(ids: np.ndarray) -> Dict[str, torch.Tensor]:
+    t = torch.from_numpy(ids.astype(np.int64))
+    return {"input_ids": t, "labels": t.clone()}
+
+
+class TokenShardDataset(Dataset):
+    """Random-access view over token shards.
+
+    ``mode="blocks"``: contiguous, non-overlapping ``block_size`` windows (no
+    padding at all; windows never cross a shard boundary).
+    ``mode="documents"``: one variable-length document per item, meant to be
+    fed through ``packing.PackedCollator``.
+    """
+
+    def __init__(self, index_path: str, block_size: int = 1024, mode: str = "blocks") -> None:
+        if mode not in ("blocks", "documents"):
+            raise ValueError(f"Unknown mode: {mode!r}")
+        self.reader = _ShardReader(index_path)
+        self.block_size = block_size
+        self.mode = mode
+        sizes = [s["tokens"] // block_size if mode == "blocks" else s["docs"] for s in self.reader.shards]
+        self._starts = [0]
+        for n in sizes:
+            self._starts.append(self._starts[-1] + n)
+
+    def __len__(self) -> int:
+        return self._starts[-1]
+
+    def __getitem__(self, i: int) -> Dict[str, torch.Tensor]:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        shard = bisect.bisect_right(self._starts, i) - 1
+        local = i - self._starts[shard]
+        ids, offsets = self.reader.open(shard)
+        if self.mode == "blocks":
+            start = local * self.block_size
+            return _example(ids[start:start + self.block_size])
+        return _example(ids[offsets[local]:offsets[local + 1]])
+
+
+class TokenShardStream(IterableDataset):
+    """Streaming ``block_size`` windows, shards split across DataLoader workers.
+
+    Shard order is reshuffled every epoch (``set_epoch``); within a shard the
+    windows are read sequentially, which keeps the page cache access pattern
+    linear.
+    """
+
+    def __init__(self, index_path: str, block_size: int = 1024, shuffle: bool = True, seed: int = 0) -> None:
+        self.reader = _ShardReader(index_path)
+        self.block_size = block_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[Dict[str, torch.Tensor]]:
+        order = list(range(len(self.reader.shards)))
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(order)
+        info = get_worker_info()
+        if info is not None:
+            order = order[info.id::info.num_workers]
+        for shard in order:
+            ids, _ = self.reader.open(shard)
+            for start in range(0, len(ids) - self.block_size + 1, self.block_size):
+                yield _example(ids[start:start + self.block_size])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tokenize text files (one document per line) into token-id shards.")
+    parser.add_argument("inputs", nargs="+", help="text files, one document per line")
+    parser.add_argument("--tokenizer", required=True, help="tokenizers JSON file, e.g. tiny-tokenizer.json")
+    parser.add_argument("--out", required=True, help="output directory for shards and index.json")
+    parser.add_argument("--docs-per-shard", type=int, default=100_000)
+    parser.add_argument("--num-proc", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--bos", default=None, help="token prepended to every document, e.g. <bos>")
+    parser.add_argument("--eos", default="<eos>", help="token appended to every document")
+    args = parser.parse_args()
+    build_shards(_read_documents(args.inputs), args.tokenizer, args.out,
+                 docs_per_shard=args.docs_per_shard, num_proc=args.num_proc,
+                 bos_token=args.bos, eos_token=args.eos)
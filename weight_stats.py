@@ -0,0 +1,328 @@
+'''
+Streaming Weight Statistics
+Description: Memory-maps ``model.safetensors`` checkpoints and walks tensors
+chunk by chunk, so weight analysis never needs a second copy of the model (the
+LLM_Weight_Exploration notebook's ``torch.cat`` over all parameters does).
+Mergeable accumulators give per-tensor, per-layer and global moments, sparsity,
+outlier counts and fixed-edge histograms, and consecutive ``checkpoint-N``
+directories can be diffed tensor by tensor.
+
+Usage:  python weight_stats.py LLM-from-Scratch/checkpoint-* --output weight_stats.json --plot hist.png
+'''
+
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import logging
+import math
+import os
+import re
+import struct
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Tuple
+
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# Logging configuration
+# -----------------------------------------------------------------------------
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# -----------------------------------------------------------------------------
+# safetensors access (no torch needed)
+# -----------------------------------------------------------------------------
+NP_DTYPES = {
+    "F64": np.float64, "F32": np.float32, "F16": np.float16, "BF16": np.uint16,
+    "I64": np.int64, "I32": np.int32, "I16": np.int16, "I8": np.int8, "U8": np.uint8, "BOOL": np.bool_,
+}
+
+
+@dataclass
+class TensorRef:
+    """Location of one tensor inside a memory-mapped safetensors file."""
+
+    name: str
+    path: str
+    dtype: str
+    shape: Tuple[int, ...]
+    offset: int
+    numel: int
+
+    def chunks(self, chunk_elems: int = 1 << 22) -> Iterator[np.ndarray]:
+        """Yield the tensor as flat float64 chunks of at most *chunk_elems* values."""
+        if self.numel == 0:
+            return
+        data = np.memmap(self.path, dtype=NP_DTYPES[self.dtype], mode="r",
+                         offset=self.offset, shape=(self.numel,))
+        for start in range(0, self.numel, chunk_elems):
+            chunk = np.asarray(data[start:start + chunk_elems])
+            if self.dtype == "BF16":
+                chunk = (chunk.astype(np.uint32) << 16).view(np.float32)
+            yield chunk.astype(np.float64)
+
+
+def checkpoint_tensors(path: str) -> Dict[str, TensorRef]:
+    """Index every tensor of a ``.safetensors`` file or a checkpoint directory."""
+    files = sorted(glob.glob(os.path.join(path, "*.safetensors"))) if os.path.isdir(path) else [path]
+    if not files:
+        raise FileNotFoundError(f"No .safetensors weights in {path}")
+    tensors = {}
+    for file in files:
+        with open(file, "rb") as f:
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_len))
+        header.pop("__metadata__", None)
+        for name, info in header.items():
+            start, _ = info["data_offsets"]
+            tensors[name] = TensorRef(name, file, info["dtype"], tuple(info["shape"]),
+                                      8 + header_len + start, int(np.prod(info["shape"], dtype=np.int64)))
+    return tensors
+
+# -----------------------------------------------------------------------------
+# Mergeable accumulators
+# -----------------------------------------------------------------------------
+@dataclass
+class StreamingStats:
+    """Count, central moments up to 4th order, extrema, zeros and non-finite values.
+
+    Chunks and partial results combine with the pairwise update formulas, so
+    stats can be built per chunk and merged per tensor, layer or model.
+    """
+
+    n: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    m3: float = 0.0
+    m4: float = 0.0
+    min: float = math.inf
+    max: float = -math.inf
+    zeros: int = 0
+    nonfinite: int = 0
+
+    def update(self, x: np.ndarray, zero_tol: float = 0.0) -> "StreamingStats":
+        finite = np.isfinite(x)
+        bad = int(x.size - finite.sum())
+        if bad:
+            x = x[finite]
+        chunk = StreamingStats(nonfinite=bad)
+        if x.size:
+            mean = float(x.mean())
+            d = x - mean
+            d2 = d * d
+            chunk.n, chunk.mean = int(x.size), mean
+            chunk.m2, chunk.m3, chunk.m4 = float(d2.sum()), float((d2 * d).sum()), float((d2 * d2).sum())
+            chunk.min, chunk.max = float(x.min()), float(x.max())
+            chunk.zeros = int((np.abs(x) <= zero_tol).sum())
+        return self.merge(chunk)
+
+    def merge(self, other: "StreamingStats") -> "StreamingStats":
+        na, nb = self.n, other.n
+        n = na + nb
+        if nb:
+            if na == 0:
+                self.mean, self.m2, self.m3, self.m4 = other.mean, other.m2, other.m3, other.m4
+            else:
+                delta = other.mean - self.mean
+                d2 = delta * delta
+                m2 = self.m2 + other.m2 + d2 * na * nb / n
+                m3 = (self.m3 + other.m3 + d2 * delta * na * nb * (na - nb) / (n * n)
+                      + 3 * delta * (na * other.m2 - nb * self.m2) / n)
+                m4 = (self.m4 + other.m4 + d2 * d2 * na * nb * (na * na - na * nb + nb * nb) / (n ** 3)
+                      + 6 * d2 * (na * na * other.m2 + nb * nb * self.m2) / (n * n)
+                      + 4 * delta * (na * other.m3 - nb * self.m3) / n)
+                self.mean += delta * nb / n
+                self.m2, self.m3, self.m4 = m2, m3, m4
+            self.n = n
+            self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+            self.zeros += other.zeros
+        self.nonfinite += other.nonfinite
+        return self
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / self.n) if self.n else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        skew = math.sqrt(self.n) * self.m3 / self.m2 ** 1.5 if self.m2 else 0.0
+        kurt = self.n * self.m4 / (self.m2 * self.m2) - 3 if self.m2 else 0.0
+        return {"count": self.n, "mean": self.mean, "std": self.std, "skew": skew, "excess_kurtosis": kurt,
+                "min": self.min if self.n else None, "max": self.max if self.n else None,
+                "rms": math.sqrt(self.m2 / self.n + self.mean ** 2) if self.n else 0.0,
+                "sparsity": self.zeros / self.n if self.n else 0.0, "nonfinite": self.nonfinite}
+
+
+@dataclass
+class StreamingHistogram:
+    """Histogram over fixed edges (plus under/overflow), mergeable by addition."""
+
+    edges: np.ndarray
+    counts: np.ndarray = field(init=False)
+    underflow: int = 0
+    overflow: int = 0
+
+    def __post_init__(self) -> None:
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+
+    def update(self, x: np.ndarray) -> "StreamingHistogram":
+        self.counts += np.histogram(x, bins=self.edges)[0]
+        self.underflow += int((x < self.edges[0]).sum())
+        self.overflow += int((x > self.edges[-1]).sum())
+        return self
+
+    def merge(self, other: "StreamingHistogram") -> "StreamingHistogram":
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        return self
+
+    def summary(self) -> Dict[str, Any]:
+        return {"edges": self.edges.tolist(), "counts": self.counts.tolist(),
+                "underflow": self.underflow, "overflow": self.overflow}
+
+# -----------------------------------------------------------------------------
+# Analysis
+# -----------------------------------------------------------------------------
+def layer_of(name: str) -> str:
+    """``transformer.h.3.attn.c_attn.weight`` -> ``transformer.h.3``; else the owning module."""
+    match = re.match(r"^(.*?\.\d+)\.", name)
+    return match.group(1) if match else name.rsplit(".", 1)[0]
+
+
+def analyze_checkpoint(path: str, bins: int = 100, outlier_sigma: float = 6.0,
+                       zero_tol: float = 0.0, chunk_elems: int = 1 << 22) -> Dict[str, Any]:
+    """Two streaming passes: moments/extrema first, then histograms and outliers.
+
+    The first pass fixes the global histogram range (so every per-tensor and
+    per-layer histogram shares edges and can be merged) and each tensor's
+    mean/std (outliers are values beyond ``outlier_sigma`` of their own tensor).
+    """
+    tensors = checkpoint_tensors(path)
+    stats: Dict[str, StreamingStats] = {}
+    for name, ref in tensors.items():
+        s = StreamingStats()
+        for chunk in ref.chunks(chunk_elems):
+            s.update(chunk, zero_tol)
+        stats[name] = s
+
+    global_stats = StreamingStats()
+    for s in stats.values():
+        global_stats.merge(s)
+    lo, hi = (global_stats.min, global_stats.max) if global_stats.n else (0.0, 1.0)
+    edges = np.linspace(lo, hi if hi > lo else lo + 1.0, bins + 1)
+
+    hists: Dict[str, StreamingHistogram] = {}
+    outliers: Dict[str, int] = {}
+    for name, ref in tensors.items():
+        h, s, count = StreamingHistogram(edges), stats[name], 0
+        for chunk in ref.chunks(chunk_elems):
+            chunk = chunk[np.isfinite(chunk)]
+            h.update(chunk)
+            if s.std:
+                count += int((np.abs(chunk - s.mean) > outlier_sigma * s.std).sum())
+        hists[name], outliers[name] = h, count
+
+    layers: Dict[str, Dict[str, Any]] = {}
+    for name in tensors:
+        key = layer_of(name)
+        entry = layers.setdefault(key, {"stats": StreamingStats(), "hist": StreamingHistogram(edges), "outliers": 0})
+        entry["stats"].merge(stats[name])
+        entry["hist"].merge(hists[name])
+        entry["outliers"] += outliers[name]
+    global_hist = StreamingHistogram(edges)
+    for h in hists.values():
+        global_hist.merge(h)
+
+    return {
+        "path": path,
+        "global": {**global_stats.summary(), "outliers": sum(outliers.values()), "histogram": global_hist.summary()},
+        "layers": {k: {**v["stats"].summary(), "outliers": v["outliers"], "histogram": v["hist"].summary()}
+                   for k, v in layers.items()},
+        "tensors": {name: {"shape": list(tensors[name].shape), "dtype": tensors[name].dtype,
+                           **stats[name].summary(), "outliers": outliers[name]}
+                    for name in tensors},
+    }
+
+
+def diff_checkpoints(path_a: str, path_b: str, chunk_elems: int = 1 << 22) -> Dict[str, Any]:
+    """Per-tensor statistics of ``b - a``, streamed chunk-by-chunk from both maps."""
+    a, b = checkpoint_tensors(path_a), checkpoint_tensors(path_b)
+    per_tensor, total_delta, total_base = {}, 0.0, 0.0
+    for name in sorted(set(a) & set(b)):
+        if a[name].shape != b[name].shape:
+            per_tensor[name] = {"shape_changed": [list(a[name].shape), list(b[name].shape)]}
+            continue
+        delta, base_sq = StreamingStats(), 0.0
+        for ca, cb in zip(a[name].chunks(chunk_elems), b[name].chunks(chunk_elems)):
+            delta.update(cb - ca)
+            base_sq += float((ca * ca).sum())
+        delta_sq = delta.m2 + delta.n * delta.mean ** 2
+        total_delta += delta_sq
+        total_base += base_sq
+        per_tensor[name] = {
+            "delta_l2": math.sqrt(delta_sq),
+            "relative_change": math.sqrt(delta_sq / base_sq) if base_sq else None,
+            "delta_max_abs": max(abs(delta.min), abs(delta.max)) if delta.n else 0.0,
+            "delta_mean": delta.mean,
+            "delta_std": delta.std,
+        }
+    return {
+        "from": path_a, "to": path_b,
+        "added": sorted(set(b) - set(a)), "removed": sorted(set(a) - set(b)),
+        "global_relative_change": math.sqrt(total_delta / total_base) if total_base else None,
+        "tensors": per_tensor,
+    }
+
+
+def _step(path: str) -> Tuple[int, str]:
+    match = re.search(r"checkpoint-(\d+)", path)
+    return (int(match.group(1)) if match else -1, path)
+
+
+def plot_histogram(hist: Dict[str, Any], out_path: str, title: str = "Weight value distribution") -> None:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    plt.figure()
+    plt.stairs(hist["counts"], hist["edges"], fill=True)
+    plt.yscale("log")
+    plt.title(title)
+    plt.savefig(out_path)
+    plt.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Streaming weight statistics over safetensors checkpoints.")
+    parser.add_argument("checkpoints", nargs="+", help="checkpoint directories or .safetensors files")
+    parser.add_argument("--bins", type=int, default=100)
+    parser.add_argument("--outlier-sigma", type=float, default=6.0)
+    parser.add_argument("--zero-tol", type=float, default=0.0, help="|w| <= tol counts as zero for sparsity")
+    parser.add_argument("--chunk-elems", type=int, default=1 << 22)
+    parser.add_argument("--no-diff", action="store_true", help="skip diffs between consecutive checkpoints")
+    parser.add_argument("--output", default="weight_stats.json")
+    parser.add_argument("--plot", default=None, help="save the global histogram of the last checkpoint here")
+    args = parser.parse_args()
+
+    paths = [p for _, p in sorted(map(_step, args.checkpoints))]
+    paths = [p for p in paths if os.path.isfile(p) or glob.glob(os.path.join(p, "*.safetensors"))]
+    report: Dict[str, Any] = {"checkpoints": {}, "diffs": []}
+    for path in paths:
+        result = analyze_checkpoint(path, args.bins, args.outlier_sigma, args.zero_tol, args.chunk_elems)
+        report["checkpoints"][path] = result
+        g = result["global"]
+        logger.info("%s: %d params, mean %.3e, std %.3e, sparsity %.4f, %d outliers",
+                    path, g["count"], g["mean"], g["std"], g["sparsity"], g["outliers"])
+    if not args.no_diff:
+        for prev, cur in zip(paths, paths[1:]):
+            d = diff_checkpoints(prev, cur, args.chunk_elems)
+            report["diffs"].append(d)
+            logger.info("%s -> %s: relative change %s", prev, cur, d["global_relative_change"])
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.plot and paths:
+        plot_histogram(report["checkpoints"][paths[-1]]["global"]["histogram"], args.plot)
+    print(f"Wrote statistics for {len(paths)} checkpoint(s) to {args.output}")